@@ -0,0 +1,110 @@
+import argparse
+import functools
+import math
+import multiprocessing
+import os
+import random
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from bot import Bot, ExpectimaxBot
+from pipeline import CHUNK_SIZE, Welford
+from runner import LAST_ROUND, campaign_seed
+
+
+# Bot variants by name; each must accept streams=True
+POLICIES: Dict[str, Callable[..., Bot]] = {
+    'weakest': Bot,
+    'killers': functools.partial(Bot, killers_first=True),
+    'expectimax': ExpectimaxBot,
+}
+
+_bots: Dict[str, Bot] = {}
+
+
+def _paired_chunk(args) -> List[Tuple[int, ...]]:
+    # Rounds reached by every policy on each campaign of the chunk
+    names, seed, start, stop = args
+    bots = []
+    for name in names:
+        if name not in _bots:
+            _bots[name] = POLICIES[name](streams=True)
+        bots.append(_bots[name])
+    return [
+        tuple(bot.run({'seed': campaign_seed(seed, index)})[0] for bot in bots)
+        for index in range(start, stop)
+    ]
+
+
+class Comparison:
+    # Win rates of each policy and the paired difference of every policy
+    # against the first, updated one campaign at a time
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        self.wins = [Welford() for _ in names]
+        self.differences = [Welford() for _ in names[1:]]
+
+    @property
+    def runs(self) -> int:
+        return self.wins[0].count
+
+    def add(self, rounds: Tuple[int, ...]):
+        won = [float(round == LAST_ROUND) for round in rounds]
+        for stats, value in zip(self.wins, won):
+            stats.add(value)
+        for stats, value in zip(self.differences, won[1:]):
+            stats.add(value - won[0])
+
+    def summary(self, z: float = 1.96) -> str:
+        lines = [f'runs: {self.runs}  baseline: {self.names[0]}']
+        for name, stats in zip(self.names, self.wins):
+            lines.append(f'  {name:12} win rate {stats.mean:.4f}')
+        base = self.wins[0]
+        for name, stats, difference in zip(self.names[1:], self.wins[1:], self.differences):
+            # what independent runs of the same size would give
+            independent = math.sqrt((base.variance + stats.variance) / self.runs) if self.runs else 0.0
+            paired = difference.stderr
+            ratio = (independent / paired) ** 2 if paired else math.inf
+            lines.append(
+                f'  {name} - {self.names[0]}: {difference.mean:+.4f} '
+                f'+- {z * paired:.4f}  (var {difference.variance:.5f}, '
+                f'independent +- {z * independent:.4f}, {ratio:.1f}x fewer campaigns)'
+            )
+        return '\n'.join(lines)
+
+
+def compare(
+    names: Sequence[str],
+    runs: int,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> Comparison:
+    # Every policy plays campaign i with the same seed and its own
+    # Simulator(streams=True), so they share spawns, offers and, while the
+    # parties match, dice: common random numbers
+    workers = workers or os.cpu_count() or 1
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    chunks = [
+        (tuple(names), seed, start, min(start + CHUNK_SIZE, runs))
+        for start in range(0, runs, CHUNK_SIZE)
+    ]
+    comparison = Comparison(names)
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        for chunk in (pool.imap if pool else map)(_paired_chunk, chunks):
+            for rounds in chunk:
+                comparison.add(rounds)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('policies', nargs='+', choices=list(POLICIES))
+    parser.add_argument('--runs', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    print(compare(args.policies, args.runs, workers=args.workers, seed=args.seed).summary())
@@ -0,0 +1,314 @@
+import dataclasses
+import functools
+from typing import Dict, Optional
+
+import numpy as np
+
+import library
+
+
+HEROES_COUNT = 5
+MONSTERS_COUNT = 3
+SIDES_COUNT = 6
+LAST_ROUND = 20
+
+KIND_SWORD = library.OP_SWORD
+KIND_SHIELD = library.OP_SHIELD
+
+KEYWORD_DEATH = library.KEYWORD_DEATH
+KEYWORD_PETRIFY = library.KEYWORD_PETRIFY
+KEYWORD_CLEAVE = library.KEYWORD_CLEAVE
+
+# Two sides per application
+NEXT_PETRIFY = np.array(library.NEXT_PETRIFIED, dtype=np.int8)
+
+
+class SideTable:
+    def __init__(self, descrs: Dict[str, tuple]):
+        self.names = list(descrs)
+        count = len(self.names)
+        self.health = np.zeros(count, dtype=np.int16)
+        self.kind = np.zeros((count, SIDES_COUNT), dtype=np.int8)
+        self.pip = np.zeros((count, SIDES_COUNT), dtype=np.int16)
+        self.keywords = np.zeros((count, SIDES_COUNT), dtype=np.int8)
+        for index, name in enumerate(self.names):
+            self.health[index] = descrs[name][0]
+            for sideID, (kind, pip, keywords) in enumerate(library.OPCODES[name]):
+                self.kind[index, sideID] = kind
+                self.pip[index, sideID] = pip
+                self.keywords[index, sideID] = keywords
+
+
+class Slots:
+    def __init__(self, table: SideTable, n_games: int, n_slots: int):
+        self.table = table
+        shape = (n_games, n_slots)
+        # column-major so per-slot columns and reductions over slots are contiguous
+        self.type = np.zeros(shape, order='F', dtype=np.int8)
+        self.health = np.zeros(shape, order='F', dtype=np.int16)
+        self.shield = np.zeros(shape, order='F', dtype=np.int16)
+        # the only effect modelled, see library.EFFECTS
+        self.petrified = np.zeros(shape, order='F', dtype=np.int8)
+        self.alive = np.zeros(shape, order='F', dtype=bool)
+        self.side = np.zeros(shape, order='F', dtype=np.int8)
+
+    def reset(self, rows: np.ndarray):
+        self.health[rows] = self.table.health[self.type[rows]]
+        self.shield[rows] = 0
+        self.petrified[rows] = 0
+        self.alive[rows] = True
+
+    def take_damage(self, rows, cols, damage):
+        # Mirrors Character.takeDamage, including the shield being zeroed
+        # before the health damage is computed.
+        shield = self.shield[rows, cols]
+        health = self.health[rows, cols]
+        absorb = (shield != 0) & (shield >= damage)
+        self.shield[rows, cols] = np.where(absorb, shield - damage, 0)
+        self.health[rows, cols] = np.where(absorb, health, health - damage)
+
+    def add_shield(self, rows, cols, shield):
+        self.shield[rows, cols] += shield
+
+    def die(self, rows, cols):
+        self.health[rows, cols] = 0
+        self.shield[rows, cols] = 0
+
+    def petrify(self, rows, cols):
+        self.petrified[rows, cols] = NEXT_PETRIFY[self.petrified[rows, cols]]
+
+    def neighbour(self, rows, cols, direction):
+        n_slots = self.alive.shape[1]
+        found = np.full(len(rows), -1, dtype=np.int64)
+        position = cols + direction
+        for _ in range(n_slots - 1):
+            inside = (position >= 0) & (position < n_slots)
+            candidate = np.where(inside, position, 0)
+            hit = inside & (found == -1) & self.alive[rows, candidate]
+            found[hit] = candidate[hit]
+            position = position + direction
+        return found
+
+    def remove_dead(self, rows):
+        for col in range(self.alive.shape[1]):
+            self.alive[rows, col] &= self.health[rows, col] > 0
+
+
+@dataclasses.dataclass
+class BatchResult:
+    rounds: np.ndarray
+    won: np.ndarray
+    last_fight_monsters: np.ndarray
+    monster_names: list
+
+    @property
+    def success(self) -> int:
+        # The same criterion sandd.py counts
+        return int((self.rounds == LAST_ROUND).sum())
+
+
+class BatchSimulator:
+    def __init__(self, n_games: int, seed: Optional[int] = None, settings: Optional[dict] = None):
+        self.n_games = n_games
+        self.settings = settings or {}
+        self.rng = np.random.default_rng(seed)
+        self.hero_table = SideTable(library.HeroLib.ALL_HEROES)
+        self.monster_table = SideTable(library.MonsterLib.ALL_MONSTERS)
+        self.heroes = Slots(self.hero_table, n_games, HEROES_COUNT)
+        self.monsters = Slots(self.monster_table, n_games, MONSTERS_COUNT)
+        self.monster_attacks = np.zeros((n_games, MONSTERS_COUNT), order='F', dtype=np.int8)
+        self.round = np.zeros(n_games, dtype=np.int16)
+        self.finished = np.zeros(n_games, dtype=bool)
+        self.won = np.zeros(n_games, dtype=bool)
+        self.last_fight_monsters = np.zeros((n_games, MONSTERS_COUNT), dtype=np.int8)
+
+        allowed_monsters = self.settings.get('allowed_monsters', self.monster_table.names)
+        self.allowed_monsters = np.array([self.monster_table.names.index(name) for name in allowed_monsters])
+        self.first_level_heroes = np.array([
+            index for index, name in enumerate(self.hero_table.names)
+            if library.HeroLib.ALL_HEROES[name][1] == 1
+        ])
+
+    def set_up(self):
+        rows = np.arange(self.n_games)
+        self.heroes.type[:] = self.rng.choice(self.first_level_heroes, size=(self.n_games, HEROES_COUNT))
+        self.round[:] = 0
+        self.finished[:] = False
+        self.won[:] = False
+        self._move_to_battle(rows)
+
+    def run(self) -> BatchResult:
+        self.set_up()
+        while not self.finished.all():
+            self.step()
+        return BatchResult(
+            rounds=self.round.copy(),
+            won=self.won.copy(),
+            last_fight_monsters=self.last_fight_monsters.copy(),
+            monster_names=list(self.monster_table.names),
+        )
+
+    def step(self):
+        live = ~self.finished
+        for heroIndex in range(HEROES_COUNT):
+            self._step_hero(live, heroIndex)
+        in_battle = live & self.monsters.alive.any(axis=1)
+        for monsterIndex in range(MONSTERS_COUNT):
+            self._step_monster(in_battle, monsterIndex)
+        self._end_turn(live)
+
+    def _move_to_battle(self, rows: np.ndarray):
+        self.round[rows] += 1
+        self.heroes.reset(rows)
+        self.monsters.type[rows] = self.rng.choice(self.allowed_monsters, size=(len(rows), MONSTERS_COUNT))
+        self.monsters.reset(rows)
+        self.last_fight_monsters[rows] = self.monsters.type[rows]
+        self._roll(rows)
+        self._generate_monster_attacks(rows)
+
+    def _roll(self, rows: np.ndarray):
+        self.heroes.side[rows] = self.rng.integers(0, SIDES_COUNT, size=(len(rows), HEROES_COUNT))
+        self.monsters.side[rows] = self.rng.integers(0, SIDES_COUNT, size=(len(rows), MONSTERS_COUNT))
+
+    def _generate_monster_attacks(self, rows: np.ndarray):
+        # Uniform choice among the alive heroes of each game
+        alive = [self.heroes.alive[rows, k] for k in range(HEROES_COUNT)]
+        count = sum(column.astype(np.int64) for column in alive)
+        for monsterIndex in range(MONSTERS_COUNT):
+            pick = (self.rng.random(len(rows)) * count).astype(np.int64)
+            target = np.zeros(len(rows), dtype=np.int8)
+            rank = np.zeros(len(rows), dtype=np.int64)
+            for heroIndex in range(HEROES_COUNT):
+                target[alive[heroIndex] & (rank == pick)] = heroIndex
+                rank += alive[heroIndex]
+            self.monster_attacks[rows, monsterIndex] = target
+
+    def _step_hero(self, live: np.ndarray, heroIndex: int):
+        heroes, monsters = self.heroes, self.monsters
+        rows = np.flatnonzero(live & heroes.alive[:, heroIndex] & monsters.alive.any(axis=1))
+        if len(rows) == 0:
+            return
+        cols = np.full(len(rows), heroIndex)
+
+        monster_alive = [monsters.alive[rows, j] for j in range(MONSTERS_COUNT)]
+        monster_side = [monsters.side[rows, j] for j in range(MONSTERS_COUNT)]
+        monster_pip = [
+            np.where(monster_alive[j], self.monster_table.pip[monsters.type[rows, j], monster_side[j]], 0)
+            for j in range(MONSTERS_COUNT)
+        ]
+        monster_health = [
+            np.where(monster_alive[j], monsters.health[rows, j], np.iinfo(np.int16).max)
+            for j in range(MONSTERS_COUNT)
+        ]
+        monster_targets = [self.monster_attacks[rows, j] for j in range(MONSTERS_COUNT)]
+
+        # lowest-HP monster with the highest attack
+        min_health = functools.reduce(np.minimum, monster_health)
+        sword_target = np.zeros(len(rows), dtype=np.int64)
+        best_score = np.zeros(len(rows), dtype=np.int16)
+        for j in range(MONSTERS_COUNT):
+            score = np.where(monster_alive[j] & (monster_health[j] == min_health), monster_pip[j], 0)
+            better = score > best_score
+            sword_target[better] = j
+            best_score = np.maximum(best_score, score)
+        has_sword_target = best_score > 0
+
+        # most endangered attacked hero, ties by first attack like ThreatModel
+        shield_target = np.zeros(len(rows), dtype=np.int64)
+        best_key = np.full(len(rows), np.iinfo(np.int64).max)
+        for k in range(HEROES_COUNT):
+            damage = np.zeros(len(rows), dtype=np.int64)
+            first = np.full(len(rows), MONSTERS_COUNT, dtype=np.int64)
+            for j in reversed(range(MONSTERS_COUNT)):
+                hit = monster_alive[j] & (monster_targets[j] == k)
+                damage += np.where(hit, monster_pip[j], 0)
+                first[hit] = j
+            targeted = (first < MONSTERS_COUNT) & heroes.alive[rows, k]
+            effective = heroes.health[rows, k] + heroes.shield[rows, k]
+            key = np.where(targeted, (effective - damage) * 8 + first, np.iinfo(np.int64).max)
+            better = key < best_key
+            shield_target[better] = k
+            best_key = np.minimum(best_key, key)
+        has_shield_target = best_key != np.iinfo(np.int64).max
+
+        sideID = heroes.side[rows, heroIndex]
+        hero_type = heroes.type[rows, heroIndex]
+        kind = self.hero_table.kind[hero_type, sideID]
+        pip = self.hero_table.pip[hero_type, sideID]
+        keywords = self.hero_table.keywords[hero_type, sideID]
+        usable = (heroes.petrified[rows, heroIndex] >> sideID) & 1 == 0
+
+        is_sword = kind == KIND_SWORD
+        sword = usable & is_sword
+        self._apply_side(
+            rows[sword], kind[sword], pip[sword], keywords[sword],
+            heroes, cols[sword], monsters, sword_target[sword], has_sword_target[sword],
+        )
+        shield = usable & ~is_sword
+        self._apply_side(
+            rows[shield], kind[shield], pip[shield], keywords[shield],
+            heroes, cols[shield], heroes, shield_target[shield], has_shield_target[shield],
+        )
+        heroes.remove_dead(rows)
+        monsters.remove_dead(rows)
+
+    def _step_monster(self, in_battle: np.ndarray, monsterIndex: int):
+        heroes, monsters = self.heroes, self.monsters
+        rows = np.flatnonzero(in_battle & monsters.alive[:, monsterIndex])
+        if len(rows) == 0:
+            return
+        cols = np.full(len(rows), monsterIndex)
+        monster_type = monsters.type[rows, monsterIndex]
+        sideID = monsters.side[rows, monsterIndex]
+        targets = self.monster_attacks[rows, monsterIndex].astype(np.int64)
+        self._apply_side(
+            rows,
+            self.monster_table.kind[monster_type, sideID],
+            self.monster_table.pip[monster_type, sideID],
+            self.monster_table.keywords[monster_type, sideID],
+            monsters, cols, heroes, targets, heroes.alive[rows, targets],
+        )
+        heroes.remove_dead(rows)
+        monsters.remove_dead(rows)
+
+    def _apply_side(self, rows, kind, pip, keywords, actor, actor_cols, target, target_cols, has_target):
+        if len(rows) == 0:
+            return
+        self._apply_kind(rows, kind, pip, target, target_cols, has_target)
+        petrify = has_target & (keywords & KEYWORD_PETRIFY != 0)
+        target.petrify(rows[petrify], target_cols[petrify])
+        cleave = has_target & (keywords & KEYWORD_CLEAVE != 0)
+        if cleave.any():
+            for direction in (1, -1):
+                neighbours = target.neighbour(rows[cleave], target_cols[cleave], direction)
+                found = neighbours != -1
+                self._apply_kind(
+                    rows[cleave][found], kind[cleave][found], pip[cleave][found],
+                    target, neighbours[found], np.ones(found.sum(), dtype=bool),
+                )
+        death = keywords & KEYWORD_DEATH != 0
+        actor.die(rows[death], actor_cols[death])
+
+    def _apply_kind(self, rows, kind, pip, target, cols, has_target):
+        sword = has_target & (kind == KIND_SWORD)
+        target.take_damage(rows[sword], cols[sword], pip[sword])
+        shield = has_target & (kind == KIND_SHIELD)
+        target.add_shield(rows[shield], cols[shield], pip[shield])
+
+    def _end_turn(self, live: np.ndarray):
+        battle_won = live & ~self.monsters.alive.any(axis=1)
+        battle_lost = live & ~battle_won & ~self.heroes.alive.any(axis=1)
+        campaign_won = battle_won & (self.round == LAST_ROUND)
+
+        self.won |= campaign_won
+        self.finished |= campaign_won | battle_lost
+        self._move_to_battle(np.flatnonzero(battle_won & ~campaign_won))
+
+        rows = np.flatnonzero(live & ~battle_won & ~battle_lost)
+        self._roll(rows)
+        self._generate_monster_attacks(rows)
+
+
+if __name__ == '__main__':
+    result = BatchSimulator(1000).run()
+    print(result.success)
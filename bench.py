@@ -0,0 +1,369 @@
+import argparse
+import copy
+import dataclasses
+import gc
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+import library
+import profiler
+import state
+from bot import Bot
+from simulator import (
+    Action, ActionBattleApplySide, ActionBattleEndTurn, ActionBattleSaveSide, ActionBattleUndo, Simulator,
+)
+
+
+def _unslotted(obj, classes: dict):
+    # Rebuild obj with plain __dict__ dataclasses, the layout state.py had before slots
+    if dataclasses.is_dataclass(obj):
+        cls = type(obj)
+        if cls not in classes:
+            classes[cls] = dataclasses.make_dataclass(cls.__name__, [f.name for f in dataclasses.fields(cls)])
+        return classes[cls](**{
+            f.name: _unslotted(getattr(obj, f.name), classes)
+            for f in dataclasses.fields(cls)
+        })
+    if isinstance(obj, dict):
+        return type(obj)((key, _unslotted(value, classes)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_unslotted(value, classes) for value in obj)
+    return obj
+
+
+def _bytes_per_state(factory, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = [factory() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del states
+    return (after - before) / count
+
+
+def bench_memory(count: int, seed: int):
+    simulator = Simulator(seed=seed)
+    simulator.set_up({})
+    live = simulator.state
+    classes = {}
+    before = _bytes_per_state(lambda: _unslotted(live, classes), count)
+    after = _bytes_per_state(lambda: copy.deepcopy(live), count)
+    print(f'bytes per live SimulatorState ({count} states, start of a battle)')
+    print(f'  __dict__ dataclasses: {before:8.0f}')
+    print(f'  slotted dataclasses:  {after:8.0f}  ({after / before - 1:+.1%})')
+
+
+def _class_path(state, side_state, selfID, targetID):
+    # Side/keyword resolution as it was before compiled opcodes
+    side_cls = library.Side.get_cls(side_state.name)
+    side_cls.apply(state, side_state, targetID)
+    for k_state in side_state.keywords.values():
+        k_cls = library.Keyword.get_cls(k_state.name)
+        k_cls.apply(state, side_state, selfID, targetID)
+
+
+def bench_dispatch(number: int, seed: int):
+    simulator = Simulator(seed=seed)
+    simulator.set_up({})
+    state = simulator.state
+    heroID = next(iter(state.heroes))
+    monsterID = next(iter(state.monsters))
+    # nothing dies while timing
+    state.heroes[heroID].health = state.monsters[monsterID].health = 10 ** 9
+
+    cases = {
+        'sword': (library.SideSword(0, 2), heroID, monsterID),
+        'shield': (library.SideShield(0, 1), heroID, heroID),
+        'sword+death': (library.SideSword(0, 4, (library.Death,)), monsterID, heroID),
+    }
+    print(f'side resolution, ns per call ({number} calls)')
+    for name, (side, selfID, targetID) in cases.items():
+        side_state = side.dump_state()
+        opcode = library.compile_sides([(type(side), (side.pip, tuple(type(k) for k in side.keywords.values())))])[0]
+        class_time = timeit.timeit(lambda: _class_path(state, side_state, selfID, targetID), number=number)
+        opcode_time = timeit.timeit(lambda: Action.apply_opcode(state, opcode, selfID, targetID), number=number)
+        state.dying.clear()
+        print(
+            f'  {name:12} class methods: {class_time / number * 1e9:6.0f}'
+            f'  opcodes: {opcode_time / number * 1e9:6.0f}  ({class_time / opcode_time:.2f}x)'
+        )
+
+
+def bench_snapshot(number: int, seed: int):
+    simulator = Simulator(seed=seed)
+    simulator.set_up({})
+    live = simulator.state
+    data = live.serialize()
+    target = state.SimulatorState()
+    deepcopy_time = timeit.timeit(lambda: copy.deepcopy(live), number=number)
+    serialize_time = timeit.timeit(live.serialize, number=number)
+    deserialize_time = timeit.timeit(lambda: target.deserialize(data), number=number)
+    print(f'state branching, us per call ({number} calls, {len(data)} byte snapshot)')
+    print(f'  copy.deepcopy: {deepcopy_time / number * 1e6:7.1f}')
+    print(f'  serialize:     {serialize_time / number * 1e6:7.1f}')
+    print(f'  deserialize:   {deserialize_time / number * 1e6:7.1f}')
+
+
+def bench_undo(number: int, seed: int):
+    simulator = Simulator(seed=seed, undo=True)
+    simulator.set_up({})
+    live = simulator.state
+    heroID = next(iter(live.heroes))
+    monsterID = next(iter(live.monsters))
+    simulator.apply_actions([ActionBattleSaveSide(list(live.heroes))])
+    action = ActionBattleApplySide(heroID, live.saved_sides[heroID], monsterID)
+    undo = ActionBattleUndo()
+
+    def do_undo():
+        simulator.apply_actions([action])
+        simulator.apply_actions([undo])
+
+    def copy_do():
+        simulator.state = copy.deepcopy(live)
+        simulator.apply_actions([action])
+        simulator.undo_log.entries.pop()
+
+    do_undo_time = timeit.timeit(do_undo, number=number)
+    copy_time = timeit.timeit(copy_do, number=number)
+    simulator.state = live
+    print(f'one branch of ActionBattleApplySide, us ({number} branches)')
+    print(f'  deepcopy + apply: {copy_time / number * 1e6:7.1f}')
+    print(f'  apply + undo:     {do_undo_time / number * 1e6:7.1f}')
+
+
+def _immortal(simulator: Simulator):
+    # Nobody dies, so an action can be repeated on the same state
+    for characters in (simulator.state.heroes, simulator.state.monsters):
+        for character_state in characters.values():
+            character_state.health = 10 ** 9
+
+
+def _case_set_up(seed):
+    simulator = Simulator()
+    seeds = iter(range(seed, seed + 10 ** 9))
+    return lambda: simulator.set_up({'seed': next(seeds)})
+
+
+def _case_move_to_battle(seed):
+    simulator = Simulator(seed=seed)
+    simulator.set_up({})
+    return simulator._move_to_battle
+
+
+def _case_roll(seed):
+    simulator = Simulator(seed=seed)
+    simulator.set_up({})
+    return simulator._roll
+
+
+def _case_apply_side(seed):
+    simulator = Simulator(seed=seed)
+    simulator.set_up({})
+    _immortal(simulator)
+    live = simulator.state
+    simulator.apply_actions([ActionBattleSaveSide(list(live.heroes))])
+    heroID = next(iter(live.heroes))
+    targets = live.monsters if library.OPCODES[live.heroes[heroID].name][live.saved_sides[heroID]][0] == library.OP_SWORD else live.heroes
+    action = ActionBattleApplySide(heroID, live.saved_sides[heroID], next(iter(targets)))
+    return lambda: simulator.apply_actions([action])
+
+
+def _case_end_turn(seed):
+    # rolls and picks targets for the next turn as well
+    simulator = Simulator(seed=seed)
+    simulator.set_up({})
+    _immortal(simulator)
+    action = ActionBattleEndTurn()
+    return lambda: simulator.apply_actions([action])
+
+
+def _case_campaign(seed):
+    bot = Bot()
+    seeds = iter(range(seed, seed + 10 ** 9))
+    return lambda: bot.run({'seed': next(seeds)})
+
+
+def _case_batch(seed):
+    # 1000 campaigns played by Bot.run(), one after the other
+    bot = Bot()
+    seeds = iter(range(seed, seed + 10 ** 9))
+
+    def run():
+        for _ in range(1000):
+            bot.run({'seed': next(seeds)})
+    return run
+
+
+def _case_numpy_batch(seed):
+    import batch
+    seeds = iter(range(seed, seed + 10 ** 9))
+    return lambda: batch.BatchSimulator(1000, seed=next(seeds)).run()
+
+
+SUITE = {
+    'set_up': _case_set_up,
+    'move_to_battle': _case_move_to_battle,
+    'roll': _case_roll,
+    'apply_side': _case_apply_side,
+    'end_turn': _case_end_turn,
+    'campaign': _case_campaign,
+    'batch_1000': _case_batch,
+    'numpy_batch_1000': _case_numpy_batch,
+}
+
+
+def measure(factory, seed: int, repeat: int, min_time: float) -> dict:
+    op = factory(seed)
+    timer = timeit.Timer(op)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    # Memory of one call, traced by tracemalloc: the peak above the start, and
+    # the blocks and bytes still allocated afterwards. Python can't count
+    # allocations freed within the call, so these are net figures; the peak
+    # is what those transient allocations cost.
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    op()
+    peak = tracemalloc.get_traced_memory()[1] - start
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # the first snapshot's own objects don't count
+    untraced = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    differences = after.filter_traces(untraced).compare_to(before.filter_traces(untraced), 'lineno')
+    return {
+        'ops_per_sec': 1 / best,
+        'us_per_op': best * 1e6,
+        'peak_bytes': peak,
+        'retained_blocks': sum(stat.count_diff for stat in differences),
+        'retained_bytes': sum(stat.size_diff for stat in differences),
+    }
+
+
+def bench_suite(names, seed: int, repeat: int, min_time: float) -> dict:
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': seed,
+        'cases': {},
+    }
+    for name in names:
+        try:
+            results['cases'][name] = measure(SUITE[name], seed, repeat, min_time)
+        except ImportError as e:
+            # batch needs numpy
+            print(f'  {name:16} skipped: {e}')
+            continue
+        case = results['cases'][name]
+        print(
+            f'  {name:16} {case["ops_per_sec"]:12.1f} ops/s  {case["us_per_op"]:12.1f} us'
+            f'  peak {case["peak_bytes"] / 1024:9.1f} KiB'
+            f'  retained {case["retained_blocks"]:6} blocks {case["retained_bytes"] / 1024:7.1f} KiB'
+        )
+    return results
+
+
+def compare(baseline: dict, current: dict, margin: float, names=None) -> bool:
+    # Fails when a case lost more than margin of its ops/sec, or is missing
+    # from either run
+    ok = True
+    for name in names if names is not None else baseline['cases']:
+        base = baseline['cases'].get(name)
+        case = current['cases'].get(name)
+        if base is None or case is None:
+            ok = False
+            print(f'  {name:16} {"":8}  MISSING from {"baseline" if base is None else "current"}')
+            continue
+        change = case['ops_per_sec'] / base['ops_per_sec'] - 1
+        slower = change < -margin
+        ok = ok and not slower
+        print(f'  {name:16} {change:+8.1%}  {"SLOWER" if slower else "ok"}')
+    return ok
+
+
+def bench_profile(runs: int, seed: int, json_path=None, collapsed_path=None):
+    profile = profiler.Profile()
+    bot = Bot()
+    bot.simulator = Simulator(profile=profile)
+    began = time.perf_counter_ns()
+    for index in range(runs):
+        bot.run({'seed': seed + index})
+    wall = time.perf_counter_ns() - began
+    print(profile.summary())
+    # whatever the simulator didn't spend is the bot's (and the timers')
+    print(f'simulator {profile.total_ns / 1e6:.0f} ms of {wall / 1e6:.0f} ms, bot {1 - profile.total_ns / wall:.1%}')
+    if json_path:
+        with open(json_path, 'w') as f:
+            f.write(profile.to_json(indent=2))
+    if collapsed_path:
+        with open(collapsed_path, 'w') as f:
+            f.write(profile.collapsed())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    memory = subparsers.add_parser('memory')
+    memory.add_argument('--count', type=int, default=1000)
+    memory.add_argument('--seed', type=int, default=0)
+    dispatch = subparsers.add_parser('dispatch')
+    dispatch.add_argument('--number', type=int, default=200000)
+    dispatch.add_argument('--seed', type=int, default=0)
+    snapshot = subparsers.add_parser('snapshot')
+    snapshot.add_argument('--number', type=int, default=5000)
+    snapshot.add_argument('--seed', type=int, default=0)
+    undo = subparsers.add_parser('undo')
+    undo.add_argument('--number', type=int, default=5000)
+    undo.add_argument('--seed', type=int, default=0)
+    for command in ('suite', 'compare'):
+        suite = subparsers.add_parser(command)
+        if command == 'compare':
+            suite.add_argument('baseline')
+            suite.add_argument('--current', help='stored results instead of running the suite')
+            suite.add_argument('--margin', type=float, default=0.1)
+        suite.add_argument('--cases', nargs='+', choices=list(SUITE), default=list(SUITE))
+        suite.add_argument('--output')
+        suite.add_argument('--seed', type=int, default=0)
+        suite.add_argument('--repeat', type=int, default=5)
+        suite.add_argument('--min-time', type=float, default=0.2)
+    profile = subparsers.add_parser('profile')
+    profile.add_argument('--runs', type=int, default=1000)
+    profile.add_argument('--seed', type=int, default=0)
+    profile.add_argument('--json')
+    profile.add_argument('--collapsed')
+    args = parser.parse_args()
+
+    if args.command == 'memory':
+        bench_memory(args.count, args.seed)
+    elif args.command == 'dispatch':
+        bench_dispatch(args.number, args.seed)
+    elif args.command == 'snapshot':
+        bench_snapshot(args.number, args.seed)
+    elif args.command == 'undo':
+        bench_undo(args.number, args.seed)
+    elif args.command == 'profile':
+        bench_profile(args.runs, args.seed, args.json, args.collapsed)
+    elif args.command in ('suite', 'compare'):
+        if args.command == 'compare' and args.current:
+            with open(args.current) as f:
+                results = json.load(f)
+        else:
+            results = bench_suite(args.cases, args.seed, args.repeat, args.min_time)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.command == 'compare':
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if not compare(baseline, results, args.margin, args.cases):
+                sys.exit(1)
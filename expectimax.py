@@ -0,0 +1,487 @@
+import collections
+import dataclasses
+import itertools
+import math
+from typing import Dict, List, Optional, Tuple
+
+import library
+import state
+import zobrist
+
+
+# A battle is a tuple of immutable character tuples in position order:
+#   (name, health, shield, petrified mask), or DEAD
+# Petrify is the only effect modelled: a new field in library.EFFECTS needs
+# its own slot here, in _hit/_resolve and in _faces.
+# and a decision node is
+#   (heroes, monsters, hero_faces, pending, monster_faces, monster_targets, horizon)
+# where faces are compiled opcodes (NO_FACE when there is nothing to apply),
+# pending marks heroes still to act and monster_targets are hero positions.
+DEAD = ()
+NO_FACE = ()
+EPSILON = 1e-12
+
+# score, survival per hero position, exact. The score is the probability of
+# winning the battle when exact, and a heuristic estimate of it otherwise.
+Value = Tuple[float, Tuple[float, ...], bool]
+
+
+def _hit(character, kind, pip):
+    name, health, shield, petrified = character
+    if kind == library.OP_SWORD:
+        # Character.takeDamage
+        if shield != 0 and shield >= pip:
+            return name, health, shield - pip, petrified
+        return name, health - pip, 0, petrified
+    return name, health, shield + pip, petrified
+
+
+def _neighbours(characters, index):
+    for direction in (1, -1):
+        position = index + direction
+        while 0 <= position < len(characters):
+            if characters[position]:
+                yield position
+                break
+            position += direction
+
+
+def _resolve(heroes, monsters, opcode, actor_is_hero, actor, target_is_hero, target):
+    # Action.apply_opcode followed by Action.remove_dying
+    kind, pip, keywords = opcode
+    if not keywords:
+        group = heroes if target_is_hero else monsters
+        character = group[target]
+        if not character:
+            return heroes, monsters
+        character = _hit(character, kind, pip)
+        group = group[:target] + (character if character[1] > 0 else DEAD,) + group[target + 1:]
+        return (group, monsters) if target_is_hero else (heroes, group)
+    heroes = list(heroes)
+    monsters = list(monsters)
+    targets = heroes if target_is_hero else monsters
+    if targets[target]:
+        character = _hit(targets[target], kind, pip)
+        if keywords & library.KEYWORD_PETRIFY:
+            name, health, shield, petrified = character
+            character = name, health, shield, library.NEXT_PETRIFIED[petrified]
+        targets[target] = character
+        if keywords & library.KEYWORD_CLEAVE:
+            for neighbour in list(_neighbours(targets, target)):
+                targets[neighbour] = _hit(targets[neighbour], kind, pip)
+    if keywords & library.KEYWORD_DEATH:
+        actors = heroes if actor_is_hero else monsters
+        if actors[actor]:
+            name, _, _, petrified = actors[actor]
+            actors[actor] = name, 0, 0, petrified
+    return (
+        tuple(c if c and c[1] > 0 else DEAD for c in heroes),
+        tuple(c if c and c[1] > 0 else DEAD for c in monsters),
+    )
+
+
+@dataclasses.dataclass
+class Evaluation:
+    score: float
+    survival: Dict[state.HeroID, float]
+    exact: bool
+
+
+class Expectimax:
+    # Bounded-horizon expectimax, not an exact solver: battles run for an
+    # unbounded number of turns (shields can absorb every hit), so no finite
+    # horizon enumerates them all. horizon is the number of turns enumerated
+    # after the current one. Chance nodes with more than max_outcomes joint
+    # rolls, and nodes past the horizon, are scored by a heuristic leaf (one
+    # more monster roll, see _leaf) and reported as not exact.
+    # score and survival are true probabilities, and the plan optimal, only
+    # when exact is True: when every line of play ends the battle within the
+    # horizon. The default, horizon 0, searches the current turn's targets,
+    # which is cheap enough for every turn of a 1000-campaign run; horizon 1
+    # costs seconds per campaign.
+    def __init__(self, horizon: int = 0, max_outcomes: int = 1000, max_memo: int = 1_000_000):
+        self.horizon = horizon
+        self.max_outcomes = max_outcomes
+        self.memo = zobrist.LRUTable(max_memo)
+        self._hero_faces: Dict[tuple, list] = {}
+        self._monster_faces: Dict[str, list] = {}
+        self._survivals: Dict[tuple, float] = {}
+        # positions only matter when something cleaves
+        self.positional = any(
+            keywords & library.KEYWORD_CLEAVE
+            for opcodes in library.OPCODES.values()
+            for _, _, keywords in opcodes
+        )
+
+    def evaluate(self, s: state.SimulatorState, acted=()) -> Evaluation:
+        node, hero_ids, _, _ = self._node(s, acted)
+        score, survival, exact = self._value(node)
+        return Evaluation(
+            score=score,
+            survival={heroID: survival[i] for i, heroID in enumerate(hero_ids) if heroID in s.heroes},
+            exact=exact,
+        )
+
+    def plan(self, s: state.SimulatorState, acted=()) -> List[Tuple[state.HeroID, state.SideID, int]]:
+        # Best (heroID, sideID, targetID) sequence for the heroes still to act
+        node, hero_ids, monster_ids, sides = self._node(s, acted)
+        order = self._canonical(node)[1]
+        memo = {}
+        plan = []
+        while True:
+            actor = self._actor(node, order)
+            if actor is None:
+                return plan
+            heroes, monsters, hero_faces, pending, monster_faces, monster_targets, horizon = node
+            pending = pending[:actor] + (False,) + pending[actor + 1:]
+            face = hero_faces[actor]
+            if face == NO_FACE:
+                node = heroes, monsters, hero_faces, pending, monster_faces, monster_targets, horizon
+                continue
+            best, best_child, best_target = None, None, None
+            for target_is_hero, target in self._targets(face, node, pending):
+                child, value = self._child(node, order, memo, actor, pending, target_is_hero, target)
+                if best is None or self._better(value, best):
+                    best, best_child, best_target = value, child, (target_is_hero, target)
+            target_is_hero, target = best_target
+            plan.append((hero_ids[actor], sides[actor], (hero_ids if target_is_hero else monster_ids)[target]))
+            if best_child is None:
+                return plan
+            node = best_child
+
+    def _node(self, s: state.SimulatorState, acted):
+        hero_ids = list(s.heroes_position)
+        monster_ids = list(s.monsters_position)
+        heroes, hero_faces, pending, sides = [], [], [], []
+        for heroID in hero_ids:
+            hero_state = s.heroes.get(heroID)
+            sideID = s.saved_sides.get(heroID, s.table_sides.get(heroID))
+            sides.append(sideID)
+            if hero_state is None:
+                heroes.append(DEAD)
+                hero_faces.append(NO_FACE)
+                pending.append(False)
+                continue
+            heroes.append((hero_state.name, hero_state.health, hero_state.shield, hero_state.petrified))
+            usable = (
+                sideID is not None
+                and library.Character.can_side_be_used(hero_state, sideID)
+                and heroID not in acted
+            )
+            hero_faces.append(library.OPCODES[hero_state.name][sideID] if usable else NO_FACE)
+            pending.append(usable)
+        hero_positions = {heroID: i for i, heroID in enumerate(hero_ids)}
+        monsters, monster_faces, monster_targets = [], [], []
+        for monsterID in monster_ids:
+            monster_state = s.monsters.get(monsterID)
+            if monster_state is None:
+                monsters.append(DEAD)
+                monster_faces.append(NO_FACE)
+                monster_targets.append(0)
+                continue
+            monsters.append((monster_state.name, monster_state.health, monster_state.shield, monster_state.petrified))
+            monster_faces.append(library.OPCODES[monster_state.name][s.monster_sides[monsterID]])
+            monster_targets.append(hero_positions[s.monster_attacks[monsterID][0]])
+        node = (
+            tuple(heroes), tuple(monsters), tuple(hero_faces), tuple(pending),
+            tuple(monster_faces), tuple(monster_targets), self.horizon,
+        )
+        return node, hero_ids, monster_ids, sides
+
+    def _canonical(self, node):
+        heroes, monsters, hero_faces, pending, monster_faces, monster_targets, horizon = node
+        alive_monsters = [i for i, monster in enumerate(monsters) if monster]
+        if self.positional:
+            return node, range(len(heroes))
+        incoming = [()] * len(heroes)
+        for rank, i in enumerate(alive_monsters):
+            incoming[monster_targets[i]] += (rank,)
+        hero_keys = [
+            (heroes[i], hero_faces[i], pending[i], incoming[i])
+            for i in range(len(heroes))
+        ]
+        order = sorted(range(len(heroes)), key=hero_keys.__getitem__)
+        ranks = [0] * len(heroes)
+        for rank, i in enumerate(order):
+            ranks[i] = rank
+        key = (
+            tuple(hero_keys[i] for i in order),
+            tuple((monsters[i], monster_faces[i], ranks[monster_targets[i]]) for i in alive_monsters),
+            horizon,
+        )
+        return key, order
+
+    def _value(self, node) -> Value:
+        # Start of a turn: memoized on the canonical key, and the heroes act in
+        # its order for the rest of the turn
+        key, order = self._canonical(node)
+        cached = self.memo.get(key)
+        if cached is None:
+            score, survival, exact = self._decide(node, order, {})
+            self.memo.store(key, (score, tuple(survival[i] for i in order), exact))
+            return score, survival, exact
+        return self._positioned(cached, order)
+
+    @staticmethod
+    def _positioned(cached, order) -> Value:
+        score, canonical_survival, exact = cached
+        survival = [0.0] * len(order)
+        for rank, i in enumerate(order):
+            survival[i] = canonical_survival[rank]
+        return score, tuple(survival), exact
+
+    @staticmethod
+    def _actor(node, order) -> Optional[int]:
+        pending = node[3]
+        # swords first, so the monsters' outcome is settled before the shields
+        # are placed and transposed sword orders meet in the memo
+        faces = node[2]
+        fallback = None
+        for i in order:
+            if pending[i]:
+                if faces[i][0] == library.OP_SWORD:
+                    return i
+                if fallback is None:
+                    fallback = i
+        return fallback
+
+    @staticmethod
+    def _targets(face, node, pending):
+        # Bot's rule: swords hit monsters, everything else targets heroes.
+        # Unattacked heroes in the same state are interchangeable targets.
+        heroes, monsters, hero_faces, _, _, monster_targets, _ = node
+        if face[0] == library.OP_SWORD:
+            return [(False, i) for i, monster in enumerate(monsters) if monster]
+        attacked = {monster_targets[i] for i, monster in enumerate(monsters) if monster}
+        targets, idle = [], set()
+        for i, hero in enumerate(heroes):
+            if not hero:
+                continue
+            if i not in attacked:
+                key = hero, hero_faces[i], pending[i]
+                if key in idle:
+                    continue
+                idle.add(key)
+            targets.append((True, i))
+        return targets
+
+    @staticmethod
+    def _better(value: Value, other: Value) -> bool:
+        if value[0] > other[0] + EPSILON:
+            return True
+        return value[0] > other[0] - EPSILON and sum(value[1]) > sum(other[1]) + EPSILON
+
+    @staticmethod
+    def _terminal(heroes, win: bool) -> Value:
+        return (1.0 if win else 0.0), tuple(1.0 if hero else 0.0 for hero in heroes), True
+
+    def _child(self, node, order, memo, actor, pending, target_is_hero, target):
+        heroes, monsters, hero_faces, _, monster_faces, monster_targets, horizon = node
+        new_heroes, monsters = _resolve(heroes, monsters, hero_faces[actor], True, actor, target_is_hero, target)
+        if not any(monsters):
+            return None, self._terminal(new_heroes, True)
+        if new_heroes is not heroes and new_heroes.count(DEAD) != heroes.count(DEAD):
+            pending = tuple(p and bool(hero) for p, hero in zip(pending, new_heroes))
+        child = new_heroes, monsters, hero_faces, pending, monster_faces, monster_targets, horizon
+        return child, self._decide(child, order, memo)
+
+    def _decide(self, node, order, memo) -> Value:
+        # Within a turn nothing is random, so plain node keys are enough
+        value = memo.get(node)
+        if value is not None:
+            return value
+        actor = self._actor(node, order)
+        if actor is None:
+            value = self._end_turn(node)
+        else:
+            heroes, monsters, hero_faces, pending, monster_faces, monster_targets, horizon = node
+            pending = pending[:actor] + (False,) + pending[actor + 1:]
+            face = hero_faces[actor]
+            if face == NO_FACE:
+                child = heroes, monsters, hero_faces, pending, monster_faces, monster_targets, horizon
+                value = self._decide(child, order, memo)
+            else:
+                best = None
+                exact = True
+                alive = len(heroes) - heroes.count(DEAD)
+                for target_is_hero, target in self._targets(face, node, pending):
+                    child_value = self._child(node, order, memo, actor, pending, target_is_hero, target)[1]
+                    exact = exact and child_value[2]
+                    if best is None or self._better(child_value, best):
+                        best = child_value
+                        # a sure win keeping everyone alive can't be beaten
+                        if best[0] > 1 - EPSILON and sum(best[1]) > alive - EPSILON:
+                            break
+                value = best[0], best[1], exact
+        memo[node] = value
+        return value
+
+    def _end_turn(self, node) -> Value:
+        heroes, monsters, _, _, monster_faces, monster_targets, horizon = node
+        for i in range(len(monsters)):
+            if monsters[i]:
+                heroes, monsters = _resolve(heroes, monsters, monster_faces[i], False, i, True, monster_targets[i])
+        if not any(monsters):
+            return self._terminal(heroes, True)
+        if not any(heroes):
+            return self._terminal(heroes, False)
+        if horizon == 0:
+            return self._leaf(heroes, monsters)
+        return self._chance(heroes, monsters, horizon - 1)
+
+    def _leaf(self, heroes, monsters) -> Value:
+        # One more roll of the monsters still standing, from MonsterLib's
+        # tables: each hero's chance to live through it, and the heroes'
+        # share of the health left once its expected damage is taken
+        names = tuple(monster[0] for monster in monsters if monster)
+        alive = len(heroes) - heroes.count(DEAD)
+        heroes_total = max(
+            0.0,
+            sum(hero[1] + hero[2] for hero in heroes if hero) - library.MonsterLib.expected_damage(names),
+        )
+        monsters_total = sum(monster[1] + monster[2] for monster in monsters if monster)
+        return (
+            heroes_total / (heroes_total + monsters_total),
+            tuple(self._survival(names, hero[1], hero[2], alive) if hero else 0.0 for hero in heroes),
+            False,
+        )
+
+    def _survival(self, names, health, shield, alive) -> float:
+        key = names, health, shield, alive
+        survival = self._survivals.get(key)
+        if survival is None:
+            survival = self._survivals[key] = library.MonsterLib.survival_random_targets(names, health, shield, alive)
+        return survival
+
+    def _faces(self, character, is_hero):
+        name, _, _, petrified = character
+        key = (name, petrified if is_hero else 0)
+        cache = self._hero_faces if is_hero else self._monster_faces
+        faces = cache.get(key)
+        if faces is None:
+            counts = collections.Counter(
+                # petrified hero sides can't be used, monsters ignore petrify
+                NO_FACE if is_hero and petrified & (1 << sideID) else opcode
+                for sideID, opcode in enumerate(library.OPCODES[name])
+            )
+            faces = [(face, count / 6) for face, count in counts.items()]
+            cache[key] = faces
+        return faces
+
+    def _chance(self, heroes, monsters, horizon) -> Value:
+        # Memoized on the battle with the heroes sorted, like _value
+        if self.positional:
+            key, order = ('chance', heroes, monsters, horizon), range(len(heroes))
+        else:
+            order = sorted(range(len(heroes)), key=heroes.__getitem__)
+            key = 'chance', tuple(heroes[i] for i in order), monsters, horizon
+        cached = self.memo.get(key)
+        if cached is not None:
+            return self._positioned(cached, order)
+        score, survival, exact = self._roll(heroes, monsters, horizon)
+        self.memo.store(key, (score, tuple(survival[i] for i in order), exact))
+        return score, survival, exact
+
+    def _groups(self, heroes, alive_heroes, faces=None) -> List[List[int]]:
+        # Positions of interchangeable heroes: same state and, given faces,
+        # the same face. No two are when positions matter.
+        groups: Dict[tuple, List[int]] = {}
+        for i in alive_heroes:
+            key = i if self.positional else (heroes[i], faces[i] if faces else None)
+            groups.setdefault(key, []).append(i)
+        return list(groups.values())
+
+    def _hero_rolls(self, heroes, alive_heroes):
+        # Each group of interchangeable heroes rolls a multiset of faces,
+        # handed out in position order: (faces, probability)
+        choices = []
+        for positions in self._groups(heroes, alive_heroes):
+            faces = self._faces(heroes[positions[0]], True)
+            group = []
+            for multiset in itertools.combinations_with_replacement(range(len(faces)), len(positions)):
+                probability = math.factorial(len(positions))
+                for index, repeats in collections.Counter(multiset).items():
+                    probability *= faces[index][1] ** repeats / math.factorial(repeats)
+                group.append((tuple(zip(positions, (faces[index][0] for index in multiset))), probability))
+            choices.append(group)
+        for roll in itertools.product(*choices):
+            faces = [NO_FACE] * len(heroes)
+            probability = 1.0
+            for assigned, group_probability in roll:
+                for i, face in assigned:
+                    faces[i] = face
+                probability *= group_probability
+            yield tuple(faces), probability
+
+    def _attacks(self, heroes, faces, alive_heroes, count):
+        # Monster targets up to swapping interchangeable heroes: each monster
+        # hits a hero already hit, or the next unhit hero of a group standing
+        # for all of them. (targets, weight) where the weights add up to
+        # len(alive_heroes) ** count.
+        classes = self._groups(heroes, alive_heroes, faces)
+        hit = [0] * len(classes)
+
+        def assign(targets, weight):
+            if len(targets) == count:
+                yield tuple(targets), weight
+                return
+            for c, positions in enumerate(classes):
+                for i in positions[:hit[c]]:
+                    yield from assign(targets + [i], weight)
+                if hit[c] < len(positions):
+                    hit[c] += 1
+                    yield from assign(targets + [positions[hit[c] - 1]], weight * (len(positions) - hit[c] + 1))
+                    hit[c] -= 1
+
+        return list(assign([], 1))
+
+    def _roll(self, heroes, monsters, horizon) -> Value:
+        # max_outcomes bounds the joint rolls left once interchangeable heroes
+        # and targets are merged
+        alive_heroes = [i for i, hero in enumerate(heroes) if hero]
+        alive_monsters = [i for i, monster in enumerate(monsters) if monster]
+        monster_faces = [self._faces(monsters[i], False) for i in alive_monsters]
+        monster_rolls = math.prod(len(faces) for faces in monster_faces)
+        hero_rolls = math.prod(
+            math.comb(len(self._faces(heroes[positions[0]], True)) + len(positions) - 1, len(positions))
+            for positions in self._groups(heroes, alive_heroes)
+        )
+        if hero_rolls * monster_rolls > self.max_outcomes:
+            return self._leaf(heroes, monsters)
+        rolls = [
+            (faces, probability, self._attacks(heroes, faces, alive_heroes, len(alive_monsters)))
+            for faces, probability in self._hero_rolls(heroes, alive_heroes)
+        ]
+        if sum(len(attacks) for _, _, attacks in rolls) * monster_rolls > self.max_outcomes:
+            return self._leaf(heroes, monsters)
+
+        score = 0.0
+        survival = [0.0] * len(heroes)
+        exact = True
+        target_probability = 1 / len(alive_heroes) ** len(alive_monsters)
+        for faces, hero_probability, attacks in rolls:
+            pending = tuple(face != NO_FACE for face in faces)
+            for monster_roll in itertools.product(*monster_faces):
+                rolled = [NO_FACE] * len(monsters)
+                monster_probability = hero_probability * target_probability
+                for i, (face, probability) in zip(alive_monsters, monster_roll):
+                    rolled[i] = face
+                    monster_probability *= probability
+                rolled = tuple(rolled)
+                for attacked, weight in attacks:
+                    targets = [0] * len(monsters)
+                    for i, heroIndex in zip(alive_monsters, attacked):
+                        targets[i] = heroIndex
+                    value = self._value((heroes, monsters, faces, pending, rolled, tuple(targets), horizon))
+                    probability = monster_probability * weight
+                    score += probability * value[0]
+                    for i, survived in enumerate(value[1]):
+                        survival[i] += probability * survived
+                    exact = exact and value[2]
+        # the first heroes of a group got the first faces and targets, but
+        # all of them share the group's survival
+        for positions in self._groups(heroes, alive_heroes):
+            share = sum(survival[i] for i in positions) / len(positions)
+            for i in positions:
+                survival[i] = share
+        return score, tuple(survival), exact
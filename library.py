@@ -1,6 +1,7 @@
 import abc
+import itertools
 import random
-from typing import List, Self, Optional, Dict, OrderedDict, Literal
+from typing import List, Self, Optional, Dict, Tuple
 
 import state
 
@@ -11,8 +12,43 @@ class Result:
         self.msg = msg
 
 
+# Compiled sides are (opcode, pip, keyword bitmask) tuples, see compile_sides
+OP_SWORD = 0
+OP_SHIELD = 1
+
+KEYWORD_DEATH = 1 << 0
+KEYWORD_PETRIFY = 1 << 1
+KEYWORD_CLEAVE = 1 << 2
+KEYWORD_ELIMINATE = 1 << 3
+
+Opcode = Tuple[int, int, int]
+
+# Order in which Character.petrify turns sides to stone
+PETRIFY_ORDER = (4, 0, 1, 2, 3, 5)
+
+
+def _next_petrified(mask: int) -> int:
+    for _ in range(2):
+        for sideID in PETRIFY_ORDER:
+            if not mask & (1 << sideID):
+                mask |= 1 << sideID
+                break
+    return mask
+
+
+# petrified sides mask -> mask after one more petrify
+NEXT_PETRIFIED = tuple(_next_petrified(mask) for mask in range(64))
+
+# Character state fields holding the mask of sides an effect disables.
+# Snapshots, Zobrist keys and the undo journal iterate over them; the
+# models with their own encoding (expectimax.py's character tuples and
+# batch.py's arrays) model petrified only and must be extended by hand.
+EFFECTS = ('petrified',)
+
+
 class Keyword(abc.ABC):
     ALL_KEYWORDS = {}
+    BIT = 0
 
     @classmethod
     def get_cls(cls, name):
@@ -28,17 +64,14 @@ class Keyword(abc.ABC):
     def apply(cls, state, side_state, selfID, targetID) -> Result:
         pass
 
-    @classmethod
-    @abc.abstractmethod
-    def undo(cls, state, side_state, selfID, targetID) -> Result:
-        pass
-
     @abc.abstractmethod
     def dump_state(self) -> state.KeywordState:
         pass
 
 
 class Death(Keyword):
+    BIT = KEYWORD_DEATH
+
     @classmethod
     def name(cls) -> str:
         return 'death'
@@ -49,13 +82,10 @@ class Death(Keyword):
             character_state = state.monsters[selfID]
         elif selfID in state.heroes:
             character_state = state.heroes[selfID]
-        Character.die(character_state)
+        if Character.die(character_state):
+            state.dying.append(selfID)
         return Result(True)
 
-    @classmethod
-    def undo(cls, state, target_state, selfID, targetID) -> Result:
-        pass
-
     # def on_end_turn(cls, state, target_state, selfID, targetID) -> Result:
     #     pass
 
@@ -64,6 +94,8 @@ class Death(Keyword):
 
 
 class Petrify(Keyword):
+    BIT = KEYWORD_PETRIFY
+
     @classmethod
     def name(self) -> str:
         return 'petrify'
@@ -79,15 +111,13 @@ class Petrify(Keyword):
             Character.petrify(character_state)
         return Result(True)
 
-    @classmethod
-    def undo(cls, state, target_state, selfID, targetID) -> Result:
-        pass
-
     def dump_state(self) -> state.KeywordState:
         return state.KeywordState(name=self.name())
 
 
 class Eliminate(Keyword):
+    BIT = KEYWORD_ELIMINATE
+
     @classmethod
     def name(self) -> str:
         return 'eliminate'
@@ -101,54 +131,35 @@ class Eliminate(Keyword):
 
 
 class Cleave(Keyword):
+    BIT = KEYWORD_CLEAVE
+
     @classmethod
     def name(self) -> str:
         return 'cleave'
 
     @classmethod
     def apply(cls, state_obj: state.SimulatorState, side_state, selfID, targetID) -> Result:
-        # TODO: refactor it later. Balanced trees would be ideal here.
-        def get_value(
-                positions: OrderedDict[CharacterID, state.PositionState],
-                targetID: CharacterID,
-                direction: Literal[-1, 1],
-        ) -> Optional[CharacterID]:
-            position_list = list(positions.keys())
-            position = positions[targetID].position + direction
-            can_iterate = position not in (-1, len(positions))
-            while can_iterate:
-                characterID = position_list[position]
-                if positions[characterID].dead == False:
-                    return characterID
-                position += direction
-                can_iterate = position not in (-1, len(positions))
-            return None
-
         if targetID in state_obj.monsters:
             # The third one exists in the side itself
             monsters_to_attack = [
-                get_value(state_obj.monsters_position, targetID, 1),
-                get_value(state_obj.monsters_position, targetID, -1),
+                state_obj.monsters_position.neighbour(targetID, 1),
+                state_obj.monsters_position.neighbour(targetID, -1),
             ]
             for monsterID in monsters_to_attack:
-                if monsterID:
+                if monsterID is not None:
                     side_cls = Side.get_cls(side_state.name)
                     side_cls.apply(state_obj, side_state, monsterID)
         elif targetID in state_obj.heroes:
             heroes_to_attack = [
-                get_value(state_obj.heroes_position, targetID, 1),
-                get_value(state_obj.heroes_position, targetID, -1),
+                state_obj.heroes_position.neighbour(targetID, 1),
+                state_obj.heroes_position.neighbour(targetID, -1),
             ]
             for heroID in heroes_to_attack:
-                if heroID:
+                if heroID is not None:
                     side_cls = Side.get_cls(side_state.name)
                     side_cls.apply(state_obj, side_state, heroID)
         return Result(True)
 
-    @classmethod
-    def undo(cls, state, target_state, selfID, targetID) -> Result:
-        pass
-
     def dump_state(self) -> state.KeywordState:
         return state.KeywordState(name=self.name())
 
@@ -181,11 +192,17 @@ class Side(abc.ABC):
             id=self.id,
             pip=self.pip,
             name=self.name(),
-            keywords={name: k.dump_state() for name, k in self.keywords.items()},
+            keywords=(
+                {name: k.dump_state() for name, k in self.keywords.items()}
+                if self.keywords
+                else state.NO_KEYWORDS
+            ),
         )
 
 
 class SideSword(Side):
+    OPCODE = OP_SWORD
+
     @classmethod
     def name(self):
         return 'sword'
@@ -197,12 +214,14 @@ class SideSword(Side):
             target_state = state.monsters[targetID]
         elif targetID in state.heroes:
             target_state = state.heroes[targetID]
-        if target_state:
-            Character.takeDamage(target_state, side_state.pip)
+        if target_state and Character.takeDamage(target_state, side_state.pip):
+            state.dying.append(targetID)
         return Result(True)
 
 
 class SideShield(Side):
+    OPCODE = OP_SHIELD
+
     @classmethod
     def name(self):
         return 'shield'
@@ -234,32 +253,46 @@ class Character:
         self.health = health
         self.sides = sides
         self.shield = shield
+        # shared by every state instantiated from this character
+        self.side_states = tuple(side.dump_state() for side in sides)
 
+    # Effects are int fields of the character state listed in EFFECTS, e.g.
+    # petrified is a mask of stone sides. disabled is their union, recomputed
+    # by update_disabled whenever one changes, so this check costs the same
+    # however many effects exist and lifting one frees only its own sides.
     @classmethod
-    # TODO: const
     def can_side_be_used(cls, character_state: CharacterState, sideID: state.SideID) -> bool:
-        for effect in character_state.effects.values():
-            if effect.name == state.EffectName.PETRIFY:
-                if sideID in character_state.effects[state.EffectName.PETRIFY].sides:
-                    return False
-        return True
+        return not character_state.disabled >> sideID & 1
+
+    @classmethod
+    def update_disabled(cls, character_state: CharacterState):
+        disabled = 0
+        for effect in EFFECTS:
+            disabled |= getattr(character_state, effect)
+        character_state.disabled = disabled
 
+    # takeDamage and die return True when health crosses zero
     @classmethod
-    def takeDamage(cls, character_state: CharacterState, damage):
+    def takeDamage(cls, character_state: CharacterState, damage) -> bool:
         cs = character_state
         if cs.shield != 0 and cs.shield >= damage:
             cs.shield -= damage
-        elif cs.shield != 0 and cs.shield < damage:
+            return False
+        alive = cs.health > 0
+        if cs.shield != 0 and cs.shield < damage:
             cs.shield = 0
             cs.health -= (damage - cs.shield)
         else:
             cs.health -= damage
+        return alive and cs.health <= 0
 
     @classmethod
-    def die(cls, character_state: CharacterState):
+    def die(cls, character_state: CharacterState) -> bool:
         cs = character_state
+        alive = cs.health > 0
         cs.shield = 0
         cs.health = 0
+        return alive
 
     @classmethod
     def addShield(cls, character_state: CharacterState, shield: int):
@@ -267,28 +300,10 @@ class Character:
 
     @classmethod
     def petrify(cls, character_state: CharacterState):
-        # print(character_state)
-        def next_side_to_petrify(current: List[state.SideID]) -> state.SideID:
-            # TODO: generator and -1
-            return {
-                -1: 4,
-                4: 0,
-                0: 1,
-                1: 2,
-                2: 3,
-                3: 5,
-                5: -1,
-            }[current[-1] if current else -1]
-
+        # two more sides in PETRIFY_ORDER
         cs = character_state
-        name = state.EffectName.PETRIFY
-        if name not in cs.effects:
-            cs.effects[name] = state.PetrifyEffectState(name=name, sides=list())
-
-        for _ in range(2):
-            next_side = next_side_to_petrify(cs.effects[name].sides)
-            if next_side != -1:
-                cs.effects[name].sides.append(next_side)
+        cs.petrified = NEXT_PETRIFIED[cs.petrified]
+        cls.update_disabled(cs)
 
 
 class Hero(Character):
@@ -319,39 +334,94 @@ class Hero(Character):
             level=self.level,
             role=self.role,
             shield=self.shield,
-            sides=[side.dump_state() for side in self.sides],
-            effects=dict(),
+            sides=tuple(side.dump_state() for side in self.sides),
         )
 
+    def instantiate(self) -> state.HeroState:
+        # Only health, shield and effects change in play
+        return state.HeroState(self.name, self.health, self.level, self.role, self.shield, self.side_states)
+
+
+class HeroPool:
+    # Heroes answering one getHeroBy query. Weighted draws use Vose's alias
+    # method, uniform ones a single rng.choice; both are O(1).
+    __slots__ = ('heroes', 'probability', 'alias')
+
+    def __init__(self, heroes: List[Hero], weights: Optional[List[float]] = None):
+        self.heroes = tuple(heroes)
+        self.probability = None
+        self.alias = None
+        if weights is None or len(set(weights)) <= 1:
+            return
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+
+    def sample(self, rng: random.Random) -> Hero:
+        if self.probability is None:
+            return rng.choice(self.heroes)
+        index = rng.randrange(len(self.heroes))
+        if rng.random() < self.probability[index]:
+            return self.heroes[index]
+        return self.heroes[self.alias[index]]
+
 
 class HeroLib:
     ALL_HEROES: Dict[str, tuple] = {}  # TODO: type
+    # One immutable Hero per name, shared by every HeroLib
+    TEMPLATES: Dict[str, Hero] = {}
     heroes: Dict[str, Hero]
 
-    def __init__(self):
+    def __init__(self, rng: Optional[random.Random] = None, seed: Optional[int] = None):
+        self.rng = rng if rng is not None else random.Random(seed)
         self.settings = {}
-        self.heroes = {
-            name: Hero.create(name)
-            for name in self.ALL_HEROES
-        }
+        self.heroes = dict(self.TEMPLATES)
+        self.allowed_heroes = set(self.heroes)
+        self.hero_weights = {}
+        self._build_index()
 
     def set_up(self, settings: dict):
         self.settings = settings
         # TODO
-        self.allowed_heroes = self.settings.get('allowed_heroes', set(self.ALL_HEROES.keys()))
+        allowed_heroes = set(self.settings.get('allowed_heroes', self.ALL_HEROES.keys()))
+        hero_weights = self.settings.get('hero_weights', {})
+        if allowed_heroes == self.allowed_heroes and hero_weights == self.hero_weights:
+            return
+        self.allowed_heroes = allowed_heroes
+        self.hero_weights = hero_weights
+        self._build_index()
+
+    def _build_index(self):
+        # (level, role) -> pool, with None standing for any level or role
+        groups: Dict[tuple, List[Hero]] = {}
+        for hero in self.heroes.values():
+            if hero.name not in self.allowed_heroes:
+                continue
+            for key in ((hero.level, hero.role), (hero.level, None), (None, hero.role), (None, None)):
+                groups.setdefault(key, []).append(hero)
+        self.index: Dict[tuple, HeroPool] = {
+            key: HeroPool(heroes, [self.hero_weights.get(hero.name, 1.0) for hero in heroes])
+            for key, heroes in groups.items()
+        }
 
     def getByName(self, name: str) -> Hero:
         return self.heroes[name]
 
     def getHeroBy(self, level: Optional[int] = None, role: Optional[state.HeroRole] = None) -> Hero:
-        def filterFunc(hero):
-            if level and hero.level != level:
-                return False
-            if role and hero.role != role:
-                return False
-            return True
-
-        return random.choice(list(filter(filterFunc, self.heroes.values())))
+        pool = self.index.get((level or None, role or None))
+        if pool is None:
+            raise IndexError('No hero with level {} and role {}'.format(level, role))
+        return pool.sample(self.rng)
 
 
 class Monster(Character):
@@ -375,23 +445,58 @@ class Monster(Character):
             name=self.name,
             health=self.health,
             shield=self.shield,
-            sides=[side.dump_state() for side in self.sides],
-            effects=dict(),
+            sides=tuple(side.dump_state() for side in self.sides),
         )
 
+    def instantiate(self) -> state.MonsterState:
+        return state.MonsterState(self.name, self.health, self.shield, self.side_states)
+
 
 class MonsterLib:
     ALL_MONSTERS = {}
+    # Filled in at load time by _precompute_monster_tables
+    DAMAGE: Dict[str, Tuple[float, ...]] = {}
+    KEYWORD_CHANCES: Dict[str, Dict[int, float]] = {}
+    SURVIVAL: Dict[Tuple[str, ...], Tuple[Tuple[float, ...], ...]] = {}
+    MAX_ATTACKERS = 3
+    TEMPLATES: Dict[str, Monster] = {}
 
     def __init__(self):
-        self.monsters = {
-            name: Monster.create(name)
-            for name in self.ALL_MONSTERS
-        }
+        self.monsters = dict(self.TEMPLATES)
 
     def getByName(self, name):
         return self.monsters[name]
 
+    @classmethod
+    def expected_damage(cls, names) -> float:
+        return sum(
+            damage * p
+            for name in names
+            for damage, p in enumerate(cls.DAMAGE[name])
+        )
+
+    @classmethod
+    def survival(cls, names: Tuple[str, ...], health: int, shield: int) -> float:
+        # P(a hero with this health and shield survives one roll of each
+        # monster in names, hitting in that order)
+        if not names:
+            return 1.0 if health > 0 else 0.0
+        table = cls.SURVIVAL[names]
+        row = table[min(shield, len(table) - 1)]
+        return row[max(0, min(health, len(row) - 1))]
+
+    @classmethod
+    def survival_random_targets(cls, names: Tuple[str, ...], health: int, shield: int, heroes_count: int) -> float:
+        # Same, before targets are known: each monster picks one of
+        # heroes_count heroes uniformly
+        hit = 1 / heroes_count
+        total = 0.0
+        for mask in range(1 << len(names)):
+            attackers = tuple(name for i, name in enumerate(names) if mask & (1 << i))
+            count = len(attackers)
+            total += hit ** count * (1 - hit) ** (len(names) - count) * cls.survival(attackers, health, shield)
+        return total
+
 
 Keyword.ALL_KEYWORDS = {
     k_cls.name(): k_cls
@@ -518,3 +623,89 @@ MonsterLib.ALL_MONSTERS = {
     #     ),
     # ),
 }
+
+
+def _damage_distribution(opcodes) -> Tuple[float, ...]:
+    # index = damage dealt by one roll
+    damages = [pip if kind == OP_SWORD else 0 for kind, pip, _ in opcodes]
+    distribution = [0.0] * (max(damages) + 1)
+    for damage in damages:
+        distribution[damage] += 1 / len(damages)
+    return tuple(distribution)
+
+
+def _keyword_chances(opcodes) -> Dict[int, float]:
+    chances = {}
+    for bit in (KEYWORD_DEATH, KEYWORD_PETRIFY, KEYWORD_CLEAVE, KEYWORD_ELIMINATE):
+        count = sum(1 for _, _, keywords in opcodes if keywords & bit)
+        if count:
+            chances[bit] = count / len(opcodes)
+    return chances
+
+
+def _survival_table(distributions) -> Tuple[Tuple[float, ...], ...]:
+    # [shield][health] -> P(health loss < health) after one hit from each
+    # distribution in order, with Character.takeDamage's shield rule. Past
+    # the last row the shield absorbs every hit, past the last column no
+    # hero can die.
+    top = sum(len(distribution) - 1 for distribution in distributions)
+    hits = [
+        [(damage, p) for damage, p in enumerate(distribution) if p]
+        for distribution in distributions
+    ]
+    table = []
+    for shield in range(top + 1):
+        outcomes = {(shield, 0): 1.0}
+        for hit in hits:
+            after = {}
+            for (shield_left, loss), p in outcomes.items():
+                for damage, q in hit:
+                    if shield_left != 0 and shield_left >= damage:
+                        key = (shield_left - damage, loss)
+                    else:
+                        key = (0, loss + damage)
+                    after[key] = after.get(key, 0.0) + p * q
+            outcomes = after
+        losses = [0.0] * (top + 1)
+        for (_, loss), p in outcomes.items():
+            losses[loss] += p
+        row = [0.0]
+        for p in losses:
+            row.append(row[-1] + p)
+        table.append(tuple(row))
+    return tuple(table)
+
+
+def _precompute_monster_tables():
+    for name, (_, side_descrs) in MonsterLib.ALL_MONSTERS.items():
+        opcodes = compile_sides(side_descrs)
+        MonsterLib.DAMAGE[name] = _damage_distribution(opcodes)
+        MonsterLib.KEYWORD_CHANCES[name] = _keyword_chances(opcodes)
+    # every ordered group of attackers a hero can face in one turn
+    for count in range(1, MonsterLib.MAX_ATTACKERS + 1):
+        for names in itertools.product(MonsterLib.ALL_MONSTERS, repeat=count):
+            MonsterLib.SURVIVAL[names] = _survival_table([MonsterLib.DAMAGE[name] for name in names])
+
+
+def compile_sides(side_descrs) -> Tuple[Opcode, ...]:
+    opcodes = []
+    for side_cls, args in side_descrs:
+        keywords = 0
+        for k_cls in (args[1] if len(args) > 1 else ()):
+            keywords |= k_cls.BIT
+        opcodes.append((side_cls.OPCODE, args[0], keywords))
+    return tuple(opcodes)
+
+
+HeroLib.TEMPLATES = {name: Hero.create(name) for name in HeroLib.ALL_HEROES}
+MonsterLib.TEMPLATES = {name: Monster.create(name) for name in MonsterLib.ALL_MONSTERS}
+
+
+# Character name -> opcode per side index, sides never change during play
+OPCODES: Dict[str, Tuple[Opcode, ...]] = {
+    name: compile_sides(descr[-1])
+    for name, descr in (*HeroLib.ALL_HEROES.items(), *MonsterLib.ALL_MONSTERS.items())
+}
+
+
+_precompute_monster_tables()
@@ -0,0 +1,252 @@
+import math
+import multiprocessing
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import library
+import state
+from bot import Bot
+from simulator import ActionBattleApplySide, ActionBattleEndTurn, ActionBattleSaveSide, Simulator
+
+
+# (visits, total reward) per root action
+RootStats = Dict[Optional[int], Tuple[int, float]]
+
+
+def legal_targets(s: state.SimulatorState, heroID: state.HeroID) -> List[Optional[int]]:
+    # Bot's rule: swords hit monsters, shields go to heroes; None is a hero
+    # with nothing to apply
+    hero_state = s.heroes.get(heroID)
+    if hero_state is None or heroID not in s.saved_sides:
+        return [None]
+    sideID = s.saved_sides[heroID]
+    if not library.Character.can_side_be_used(hero_state, sideID):
+        return [None]
+    if library.OPCODES[hero_state.name][sideID][0] == library.OP_SWORD:
+        return list(s.monsters)
+    return list(s.heroes)
+
+
+def rollout_target(s: state.SimulatorState, heroID: state.HeroID) -> Optional[int]:
+    # Default policy: swords at the weakest monster, shields at the hero
+    # closest to dying from this turn's attacks
+    hero_state = s.heroes.get(heroID)
+    if hero_state is None or heroID not in s.saved_sides:
+        return None
+    sideID = s.saved_sides[heroID]
+    if not library.Character.can_side_be_used(hero_state, sideID):
+        return None
+    if library.OPCODES[hero_state.name][sideID][0] == library.OP_SWORD:
+        return min(s.monsters, key=lambda monsterID: s.monsters[monsterID].health)
+    incoming = dict.fromkeys(s.heroes, 0)
+    for monsterID, sideID in s.monster_sides.items():
+        pip = library.OPCODES[s.monsters[monsterID].name][sideID][1]
+        for targetID in s.monster_attacks.get(monsterID, ()):
+            if targetID in incoming:
+                incoming[targetID] += pip
+    return min(
+        s.heroes,
+        key=lambda targetID: s.heroes[targetID].health + s.heroes[targetID].shield - incoming[targetID],
+    )
+
+
+class Node:
+    __slots__ = ('children', 'untried', 'visits', 'value')
+
+    def __init__(self):
+        self.children: Dict[Optional[int], Node] = {}
+        self.untried: Optional[List[Optional[int]]] = None
+        self.visits = 0
+        self.value = 0.0
+
+
+class Search:
+    # UCT over the targets of the heroes still to act this turn. Each rollout
+    # restores the root from its packed snapshot, so nothing is deep-copied;
+    # past the tree the default policy plays until the battle ends or
+    # max_turns, where the heroes' share of the remaining health is scored.
+    def __init__(self, exploration: float = 1.4, max_turns: int = 10):
+        self.exploration = exploration
+        self.max_turns = max_turns
+        self.simulator = Simulator()
+
+    def run(
+        self,
+        root: bytes,
+        heroIDs: List[state.HeroID],
+        seed: int,
+        rollouts: int = 100,
+        time_limit: Optional[float] = None,
+    ) -> Tuple[RootStats, int]:
+        simulator = self.simulator
+        simulator.rng.seed(seed)
+        tree = Node()
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        count = 0
+        while True:
+            if deadline is not None:
+                if count and time.perf_counter() >= deadline:
+                    break
+            elif count >= rollouts:
+                break
+            simulator.state.deserialize(root)
+            path = [tree]
+            node = tree
+            depth = 0
+            # selection and expansion
+            while depth < len(heroIDs) and simulator.state.phase == state.Phase.BATTLE:
+                if node.untried is None:
+                    node.untried = legal_targets(simulator.state, heroIDs[depth])
+                if node.untried:
+                    targetID = node.untried.pop(simulator.rng.randrange(len(node.untried)))
+                    child = node.children[targetID] = Node()
+                else:
+                    targetID, child = self._select(node)
+                self._apply(heroIDs[depth], targetID)
+                path.append(child)
+                node = child
+                depth += 1
+                if child.visits == 0:
+                    break
+            reward = self._rollout(heroIDs[depth:])
+            for node in path:
+                node.visits += 1
+                node.value += reward
+            count += 1
+        return {targetID: (child.visits, child.value) for targetID, child in tree.children.items()}, count
+
+    def _select(self, node: Node):
+        log_visits = math.log(node.visits)
+        return max(
+            node.children.items(),
+            key=lambda item: item[1].value / item[1].visits
+            + self.exploration * math.sqrt(log_visits / item[1].visits),
+        )
+
+    def _apply(self, heroID, targetID):
+        if targetID is None:
+            return
+        s = self.simulator.state
+        if targetID not in s.heroes and targetID not in s.monsters:
+            return
+        self.simulator.apply_actions([ActionBattleApplySide(heroID, s.saved_sides[heroID], targetID)])
+
+    def _rollout(self, heroIDs: List[state.HeroID]) -> float:
+        simulator = self.simulator
+        s = simulator.state
+        for turn in range(self.max_turns):
+            for heroID in heroIDs:
+                if s.phase != state.Phase.BATTLE:
+                    break
+                self._apply(heroID, rollout_target(s, heroID))
+            if s.phase != state.Phase.BATTLE:
+                break
+            simulator.apply_actions([ActionBattleEndTurn()])
+            if s.phase != state.Phase.BATTLE:
+                break
+            heroIDs = list(s.heroes)
+            simulator.apply_actions([ActionBattleSaveSide(heroIDs)])
+        if s.phase != state.Phase.BATTLE:
+            return 1.0 if not s.monsters else 0.0
+        heroes_total = sum(hero.health + hero.shield for hero in s.heroes.values())
+        monsters_total = sum(monster.health + monster.shield for monster in s.monsters.values())
+        return heroes_total / (heroes_total + monsters_total)
+
+
+_search: Optional[Search] = None
+
+
+def _search_worker(args) -> Tuple[RootStats, int]:
+    global _search
+    exploration, max_turns, root, heroIDs, seed, rollouts, time_limit = args
+    if _search is None or (_search.exploration, _search.max_turns) != (exploration, max_turns):
+        _search = Search(exploration, max_turns)
+    return _search.run(root, heroIDs, seed, rollouts, time_limit)
+
+
+class MCTSBot(Bot):
+    # Searches every hero's target with rollouts (per worker) or time_limit
+    # seconds per decision. With workers > 1 each worker searches the same
+    # root with its own seed and the root statistics are summed.
+    def __init__(
+        self,
+        seed=None,
+        rollouts: int = 100,
+        time_limit: Optional[float] = None,
+        workers: int = 1,
+        exploration: float = 1.4,
+        max_turns: int = 10,
+        streams: bool = False,
+    ):
+        super().__init__(seed=seed, streams=streams)
+        self.rollouts = rollouts
+        self.time_limit = time_limit
+        self.workers = workers
+        self.search = Search(exploration, max_turns)
+        self.search_rng = random.Random(seed)
+        self.pool = None
+        self.rollouts_done = 0
+        self.search_time = 0.0
+
+    @property
+    def rollouts_per_second(self) -> float:
+        return self.rollouts_done / self.search_time if self.search_time else 0.0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def run(self, settings=None):
+        if settings and 'seed' in settings:
+            self.search_rng.seed(settings['seed'])
+        return super().run(settings)
+
+    def _step_battle(self):
+        s = self.simulator
+        self.last_fight_monsters = s.last_fight_monsters
+
+        s.apply_actions([ActionBattleSaveSide(list(s.state.heroes))])
+        heroIDs = list(s.state.heroes)
+        for index, heroID in enumerate(heroIDs):
+            if s.state.phase != state.Phase.BATTLE:
+                break
+            targets = legal_targets(s.state, heroID)
+            targetID = targets[0] if len(targets) == 1 else self._decide(heroIDs[index:])
+            if targetID is not None:
+                s.apply_actions([ActionBattleApplySide(heroID, s.state.saved_sides[heroID], targetID)])
+        s.apply_actions([ActionBattleEndTurn()])
+
+    def _decide(self, heroIDs: List[state.HeroID]) -> Optional[int]:
+        root = self.simulator.state.serialize()
+        began = time.perf_counter()
+        if self.workers > 1:
+            if self.pool is None:
+                if multiprocessing.current_process().daemon:
+                    raise RuntimeError('search workers cannot start inside a pool worker, use workers=1')
+                self.pool = multiprocessing.Pool(self.workers)
+            jobs = [
+                (
+                    self.search.exploration, self.search.max_turns, root, heroIDs,
+                    self.search_rng.getrandbits(64), self.rollouts, self.time_limit,
+                )
+                for _ in range(self.workers)
+            ]
+            results = self.pool.map(_search_worker, jobs)
+        else:
+            results = [self.search.run(
+                root, heroIDs, self.search_rng.getrandbits(64), self.rollouts, self.time_limit,
+            )]
+        self.search_time += time.perf_counter() - began
+
+        visits: Dict[Optional[int], List[float]] = {}
+        for stats, count in results:
+            self.rollouts_done += count
+            for targetID, (child_visits, value) in stats.items():
+                total = visits.setdefault(targetID, [0, 0.0])
+                total[0] += child_visits
+                total[1] += value
+        # most visited, then best mean
+        return max(visits, key=lambda targetID: (visits[targetID][0], visits[targetID][1] / visits[targetID][0]))
@@ -0,0 +1,275 @@
+import collections
+import dataclasses
+import itertools
+import json
+import math
+import multiprocessing
+import multiprocessing.pool
+import os
+import random
+from typing import Callable, Counter, Deque, Iterable, Iterator, List, Optional, Tuple
+
+from bot import Bot
+from runner import LAST_ROUND, campaign_seed, close_bots, worker_bot
+
+
+CHUNK_SIZE = 1000
+PARTY_SIZE = 5
+
+
+@dataclasses.dataclass(slots=True)
+class CampaignRecord:
+    index: int
+    round: int
+    # heroes lost in each battle, one entry per round reached
+    deaths: Tuple[int, ...]
+    last_fight_monsters: Tuple[str, ...]
+
+    @property
+    def won(self) -> bool:
+        return self.round == LAST_ROUND
+
+    def to_json(self) -> str:
+        return json.dumps(
+            [self.index, self.round, list(self.deaths), list(self.last_fight_monsters)],
+            separators=(',', ':'),
+        )
+
+    @classmethod
+    def from_json(cls, line: str) -> 'CampaignRecord':
+        index, round, deaths, monsters = json.loads(line)
+        return cls(index, round, tuple(deaths), tuple(monsters))
+
+
+def campaigns(bot_factory: Callable[[], Bot], seed: int, start: int, stop: int) -> Iterator[CampaignRecord]:
+    bot = worker_bot(bot_factory)
+    for index in range(start, stop):
+        round, last_fight_monsters = bot.run({'seed': campaign_seed(seed, index)})
+        yield CampaignRecord(index, round, tuple(bot.deaths), tuple(last_fight_monsters))
+
+
+def _campaigns_chunk(args) -> List[CampaignRecord]:
+    return list(campaigns(*args))
+
+
+class RecordStream:
+    # Records in index order. Workers get chunk_size campaigns at a time and
+    # only 1 + ahead chunks per worker are submitted before they are read, so
+    # memory stays flat and a reader that stops early (close(), or dropping
+    # the stream) leaves little work behind. simulated counts every campaign
+    # played, read or not; on close the chunks in flight are waited for.
+    def __init__(
+        self,
+        runs: int,
+        workers: Optional[int] = None,
+        seed: Optional[int] = None,
+        bot_factory: Callable[[], Bot] = Bot,
+        start: int = 0,
+        chunk_size: int = CHUNK_SIZE,
+        ahead: int = 1,
+    ):
+        self.runs = runs
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed if seed is not None else random.SystemRandom().getrandbits(32)
+        self.bot_factory = bot_factory
+        self.start = start
+        self.chunk_size = max(1, chunk_size)
+        self.ahead = ahead
+        self.simulated = 0
+        self._records = self._generate()
+
+    def __iter__(self) -> Iterator[CampaignRecord]:
+        return self._records
+
+    def __next__(self) -> CampaignRecord:
+        return next(self._records)
+
+    def close(self):
+        self._records.close()
+
+    def _generate(self) -> Iterator[CampaignRecord]:
+        stop = self.start + self.runs
+        if self.workers == 1:
+            try:
+                for record in campaigns(self.bot_factory, self.seed, self.start, stop):
+                    self.simulated += 1
+                    yield record
+            finally:
+                close_bots()
+            return
+        chunks = (
+            (self.bot_factory, self.seed, chunk_start, min(chunk_start + self.chunk_size, stop))
+            for chunk_start in range(self.start, stop, self.chunk_size)
+        )
+        pending: Deque[multiprocessing.pool.AsyncResult] = collections.deque()
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            for chunk in itertools.islice(chunks, self.workers * (1 + self.ahead)):
+                pending.append(pool.apply_async(_campaigns_chunk, (chunk,)))
+            while pending:
+                chunk_records = pending.popleft().get()
+                self.simulated += len(chunk_records)
+                for chunk in itertools.islice(chunks, 1):
+                    pending.append(pool.apply_async(_campaigns_chunk, (chunk,)))
+                yield from chunk_records
+        finally:
+            # count what was started, but start nothing new
+            for result in pending:
+                self.simulated += len(result.get())
+            pool.terminate()
+
+
+def records(
+    runs: int,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+    bot_factory: Callable[[], Bot] = Bot,
+    start: int = 0,
+    chunk_size: int = CHUNK_SIZE,
+    ahead: int = 1,
+) -> RecordStream:
+    return RecordStream(runs, workers, seed, bot_factory, start, chunk_size, ahead)
+
+
+class Welford:
+    # Running mean and variance in one pass
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other: 'Welford'):
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+    @property
+    def stderr(self) -> float:
+        return math.sqrt(self.variance / self.count) if self.count else 0.0
+
+
+class Aggregates:
+    # Everything summary() needs, in memory independent of the run length
+    def __init__(self):
+        self.wins = 0
+        self.rounds = Welford()
+        self.deaths = Welford()
+        # campaigns that fought round r, and how many lost k heroes in it
+        self.reached = [0] * (LAST_ROUND + 1)
+        self.round_deaths = [[0] * (PARTY_SIZE + 1) for _ in range(LAST_ROUND + 1)]
+        self.loss_monsters: Counter[Tuple[str, ...]] = collections.Counter()
+
+    @property
+    def runs(self) -> int:
+        return self.rounds.count
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.runs if self.runs else 0.0
+
+    def add(self, record: CampaignRecord):
+        self.rounds.add(record.round)
+        self.deaths.add(sum(record.deaths))
+        if record.won:
+            self.wins += 1
+        else:
+            self.loss_monsters[tuple(sorted(record.last_fight_monsters))] += 1
+        for round, deaths in enumerate(record.deaths, 1):
+            self.reached[round] += 1
+            self.round_deaths[round][deaths] += 1
+
+    def merge(self, other: 'Aggregates'):
+        self.wins += other.wins
+        self.rounds.merge(other.rounds)
+        self.deaths.merge(other.deaths)
+        for round in range(LAST_ROUND + 1):
+            self.reached[round] += other.reached[round]
+            for deaths in range(PARTY_SIZE + 1):
+                self.round_deaths[round][deaths] += other.round_deaths[round][deaths]
+        self.loss_monsters.update(other.loss_monsters)
+
+    def survival(self) -> List[float]:
+        # share of campaigns that reached each round, from round 1
+        return [reached / self.runs if self.runs else 0.0 for reached in self.reached[1:]]
+
+    def summary(self) -> str:
+        lines = [
+            f'runs: {self.runs}  wins: {self.wins}  win rate: {self.win_rate:.4f}',
+            f'rounds: mean {self.rounds.mean:.3f}  sd {self.rounds.stddev:.3f}  '
+            f'hero deaths: mean {self.deaths.mean:.3f}  sd {self.deaths.stddev:.3f}',
+            f'{"round":>5} {"reached":>8} ' + ' '.join(f'{f"-{k}":>7}' for k in range(PARTY_SIZE + 1)),
+        ]
+        for round in range(1, LAST_ROUND + 1):
+            if not self.reached[round]:
+                break
+            lines.append(
+                f'{round:5} {self.reached[round] / self.runs:8.4f} '
+                + ' '.join(f'{count:7}' for count in self.round_deaths[round])
+            )
+        for monsters, count in self.loss_monsters.most_common(5):
+            lines.append(f'lost to {", ".join(monsters)}: {count}')
+        return '\n'.join(lines)
+
+
+class RecordWriter:
+    # Append-only JSONL, one record per line, flushed every chunk_size records
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE):
+        self.file = open(path, 'a')
+        self.chunk_size = chunk_size
+        self.lines: List[str] = []
+
+    def write(self, record: CampaignRecord):
+        self.lines.append(record.to_json())
+        if len(self.lines) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.file.write('\n'.join(self.lines) + '\n')
+            self.lines.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path: str) -> Iterator[CampaignRecord]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield CampaignRecord.from_json(line)
+
+
+def consume(stream: Iterable[CampaignRecord], aggregates: Aggregates, writer: Optional[RecordWriter] = None) -> Aggregates:
+    for record in stream:
+        aggregates.add(record)
+        if writer is not None:
+            writer.write(record)
+    return aggregates
@@ -0,0 +1,143 @@
+import collections
+import json
+import time
+from typing import Counter, Dict, List, Tuple
+
+import library
+
+
+Stack = Tuple[str, ...]
+
+ROOT = 'apply_actions'
+ROLL = 'roll'
+MOVE_TO = 'move_to'
+
+_SIDE_NAMES = {cls.OPCODE: cls.__name__ for cls in library.Side.__subclasses__()}
+_KEYWORD_NAMES = {cls.BIT: cls.__name__ for cls in library.Keyword.__subclasses__()}
+
+
+def opcode_label(opcode: library.Opcode) -> str:
+    # Side and keyword classes the opcode was compiled from, e.g. SideSword[Petrify]
+    kind, _, keywords = opcode
+    names = [name for bit, name in sorted(_KEYWORD_NAMES.items()) if keywords & bit]
+    return _SIDE_NAMES[kind] + (f'[{",".join(names)}]' if names else '')
+
+
+class Profile:
+    # Counts and nanoseconds per call stack, filled by a Simulator built with
+    # profile=. A stack's time excludes its children, as flamegraphs expect;
+    # every call is also counted on its own stack, with 0 ns if all its time
+    # belongs to a child:
+    #   apply_actions;BATTLE_APPLY_SIDE;SideSword[Petrify]
+    #   apply_actions;BATTLE_END_TURN;SideSword
+    #   apply_actions;BATTLE_END_TURN;roll
+    #   move_to;BATTLE->LEVEL_UP
+    #   move_to;LEVEL_UP->BATTLE;roll
+    def __init__(self):
+        self.counts: Counter[Stack] = collections.Counter()
+        self.times: Counter[Stack] = collections.Counter()
+        self.labels: Dict[library.Opcode, str] = {}
+        # [stack, start, children's ns] of the frames entered and not exited
+        self._open: List[list] = []
+
+    def add(self, stack: Stack, ns: int):
+        self.counts[stack] += 1
+        self.times[stack] += ns
+
+    def enter(self, *frames: str):
+        # Times frames on top of the innermost open one until exit()
+        parent = self._open[-1][0] if self._open else ()
+        self._open.append([parent + frames, time.perf_counter_ns(), 0])
+
+    def exit(self):
+        stack, began, children = self._open.pop()
+        elapsed = time.perf_counter_ns() - began
+        self.add(stack, elapsed - children)
+        if self._open:
+            self._open[-1][2] += elapsed
+
+    def label(self, opcode: library.Opcode) -> str:
+        label = self.labels.get(opcode)
+        if label is None:
+            label = self.labels[opcode] = opcode_label(opcode)
+        return label
+
+    def merge(self, other: 'Profile'):
+        self.counts.update(other.counts)
+        self.times.update(other.times)
+
+    def clear(self):
+        self.counts.clear()
+        self.times.clear()
+
+    @property
+    def total_ns(self) -> int:
+        return sum(self.times.values())
+
+    def _group(self, level: int, prefix: Stack = ()) -> Dict[str, Tuple[int, int]]:
+        # (calls, ns) per frame at level under prefix, children's time included
+        groups: Dict[str, list] = {}
+        for stack, ns in self.times.items():
+            if len(stack) <= level or stack[:len(prefix)] != prefix:
+                continue
+            group = groups.setdefault(stack[level], [0, 0])
+            group[1] += ns
+            if len(stack) == level + 1:
+                group[0] += self.counts[stack]
+        return {name: (count, ns) for name, (count, ns) in groups.items()}
+
+    def by_action(self) -> Dict[str, Tuple[int, int]]:
+        return self._group(1, (ROOT,))
+
+    def by_side(self) -> Dict[str, Tuple[int, int]]:
+        # hero sides, applied by BATTLE_APPLY_SIDE
+        return self._group(2, (ROOT, 'BATTLE_APPLY_SIDE'))
+
+    def by_monster_side(self) -> Dict[str, Tuple[int, int]]:
+        # monster sides, applied one by one by BATTLE_END_TURN before the next roll
+        groups = self._group(2, (ROOT, 'BATTLE_END_TURN'))
+        groups.pop(ROLL, None)
+        return groups
+
+    def by_transition(self) -> Dict[str, Tuple[int, int]]:
+        return self._group(1, (MOVE_TO,))
+
+    def to_dict(self) -> dict:
+        return {
+            'total_ns': self.total_ns,
+            'stacks': [
+                {'stack': list(stack), 'count': self.counts[stack], 'ns': ns}
+                for stack, ns in sorted(self.times.items())
+            ],
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Profile':
+        profile = cls()
+        for entry in data['stacks']:
+            stack = tuple(entry['stack'])
+            profile.counts[stack] = entry['count']
+            profile.times[stack] = entry['ns']
+        return profile
+
+    def collapsed(self) -> str:
+        # One "frame;frame;frame ns" line per stack, the input of flamegraph.pl
+        return ''.join(f'{";".join(stack)} {ns}\n' for stack, ns in sorted(self.times.items()) if ns)
+
+    def summary(self) -> str:
+        total = self.total_ns or 1
+        lines = []
+        for title, groups in (
+            ('action', self.by_action()),
+            ('side', self.by_side()),
+            ('monster side', self.by_monster_side()),
+            ('phase transition', self.by_transition()),
+        ):
+            lines.append(f'{title:28} {"count":>10} {"ms":>10} {"ns/call":>10} {"share":>7}')
+            for name, (count, ns) in sorted(groups.items(), key=lambda item: -item[1][1]):
+                per_call = ns / count if count else 0
+                lines.append(f'  {name:26} {count:10} {ns / 1e6:10.2f} {per_call:10.0f} {ns / total:7.1%}')
+        return '\n'.join(lines)
@@ -0,0 +1,360 @@
+import argparse
+import dataclasses
+import json
+import multiprocessing
+import os
+import struct
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from simulator import (
+    Action, ActionBattleApplySide, ActionBattleEndTurn, ActionBattleReroll, ActionBattleSaveSide,
+    ActionBattleUndo, ActionLevelUp, Simulator,
+)
+
+
+# A replay is a header and the packed actions:
+#   magic, version, flags (undo, streams), seed, settings JSON length, actions length
+#   settings JSON without the seed
+#   actions: one code byte each, 0x80 set on the last action of an
+#   apply_actions batch, then its operands as bytes:
+#     SAVE_SIDE count hero...   APPLY_SIDE hero side target   UNDO count
+# A replay file is replays back to back.
+MAGIC = b'SDRP'
+VERSION = 1
+HEADER = struct.Struct('<4sBBQHI')
+
+FLAG_UNDO = 1
+FLAG_STREAMS = 2
+
+SAVE_SIDE = 1
+APPLY_SIDE = 2
+END_TURN = 3
+LEVEL_UP = 4
+REROLL = 5
+UNDO = 6
+LAST_IN_BATCH = 0x80
+NO_TARGET = 0xff
+
+
+@dataclasses.dataclass
+class Replay:
+    seed: int
+    settings: dict
+    actions: bytes
+    undo: bool = False
+    streams: bool = False
+
+    def to_bytes(self) -> bytes:
+        settings = json.dumps(self.settings, separators=(',', ':')).encode() if self.settings else b''
+        flags = FLAG_UNDO * self.undo | FLAG_STREAMS * self.streams
+        header = HEADER.pack(MAGIC, VERSION, flags, self.seed, len(settings), len(self.actions))
+        return header + settings + self.actions
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int = 0) -> Tuple['Replay', int]:
+        # the replay at offset and the offset after it
+        magic, version, flags, seed, settings_length, actions_length = HEADER.unpack_from(data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a replay or unsupported replay version')
+        offset += HEADER.size
+        settings = json.loads(data[offset:offset + settings_length]) if settings_length else {}
+        offset += settings_length
+        actions = bytes(data[offset:offset + actions_length])
+        return cls(seed, settings, actions, bool(flags & FLAG_UNDO), bool(flags & FLAG_STREAMS)), offset + actions_length
+
+
+def encode(actions: List[Action], out: bytearray):
+    last = len(actions) - 1
+    for index, action in enumerate(actions):
+        batch = LAST_IN_BATCH if index == last else 0
+        if isinstance(action, ActionBattleApplySide):
+            target = NO_TARGET if action.targetID is None else action.targetID
+            out += bytes((APPLY_SIDE | batch, action.heroID, action.sideID, target))
+        elif isinstance(action, ActionBattleSaveSide):
+            out += bytes((SAVE_SIDE | batch, len(action.heroes), *action.heroes))
+        elif isinstance(action, ActionBattleEndTurn):
+            out.append(END_TURN | batch)
+        elif isinstance(action, ActionLevelUp):
+            out.append(LEVEL_UP | batch)
+        elif isinstance(action, ActionBattleReroll):
+            out.append(REROLL | batch)
+        elif isinstance(action, ActionBattleUndo):
+            out += bytes((UNDO | batch, action.count))
+        else:
+            raise ValueError(f'Cannot record {type(action).__name__}')
+
+
+def decode(data: bytes) -> List[List[Action]]:
+    # apply_actions batches in recorded order
+    batches = []
+    batch = []
+    offset = 0
+    while offset < len(data):
+        code = data[offset]
+        kind = code & ~LAST_IN_BATCH
+        if kind == APPLY_SIDE:
+            heroID, sideID, targetID = data[offset + 1:offset + 4]
+            batch.append(ActionBattleApplySide(heroID, sideID, None if targetID == NO_TARGET else targetID))
+            offset += 4
+        elif kind == SAVE_SIDE:
+            count = data[offset + 1]
+            batch.append(ActionBattleSaveSide(list(data[offset + 2:offset + 2 + count])))
+            offset += 2 + count
+        elif kind == END_TURN:
+            batch.append(ActionBattleEndTurn())
+            offset += 1
+        elif kind == LEVEL_UP:
+            batch.append(ActionLevelUp())
+            offset += 1
+        elif kind == REROLL:
+            batch.append(ActionBattleReroll())
+            offset += 1
+        elif kind == UNDO:
+            batch.append(ActionBattleUndo(data[offset + 1]))
+            offset += 2
+        else:
+            raise ValueError(f'Bad action code {code} at {offset}')
+        if code & LAST_IN_BATCH:
+            batches.append(batch)
+            batch = []
+    return batches
+
+
+class Recorder:
+    # Passed to Simulator(recorder=...): every set_up starts a new replay and
+    # every apply_actions batch is appended to it. Settings need a seed.
+    def __init__(self):
+        self.actions = bytearray()
+        self.seed = 0
+        self.settings: dict = {}
+        self.undo = False
+        self.streams = False
+
+    def wrap(self, apply_actions: Callable) -> Callable:
+        actions_out = self.actions
+
+        def recorded(actions):
+            if actions:
+                encode(actions, actions_out)
+            return apply_actions(actions)
+        return recorded
+
+    def begin(self, simulator: Simulator, settings: dict):
+        if 'seed' not in settings:
+            raise ValueError('Recording needs a seed in the settings')
+        self.actions.clear()
+        self.seed = settings['seed']
+        self.settings = {key: value for key, value in settings.items() if key != 'seed'}
+        self.undo = simulator.undo_log is not None
+        self.streams = simulator.streams
+
+    def replay(self) -> Replay:
+        return Replay(self.seed, self.settings, bytes(self.actions), self.undo, self.streams)
+
+
+@dataclasses.dataclass
+class Checkpoint:
+    position: int
+    state: bytes
+    rng_states: list
+    last_fight_monsters: list
+
+
+class Replayer:
+    # Plays a replay on its own Simulator, no Bot involved. The start of the
+    # first battle and of every checkpoint_every-th round (0: none) is kept,
+    # so seek() restores the nearest one at or before the round asked for
+    # and plays only the rest.
+    def __init__(self, replay: Replay, checkpoint_every: int = 5):
+        self.replay = replay
+        self.batches = decode(replay.actions)
+        self.checkpoint_every = checkpoint_every
+        self.checkpoints: Dict[int, Checkpoint] = {}
+        self.simulator = Simulator(undo=replay.undo, streams=replay.streams)
+        self.rngs = [self.simulator.rng]
+        if replay.streams:
+            self.rngs += self.simulator.stream_rngs.values()
+        self.reset()
+
+    def reset(self):
+        self.simulator.set_up({**self.replay.settings, 'seed': self.replay.seed})
+        self.position = 0
+        self._checkpoint(force=True)
+
+    @property
+    def done(self) -> bool:
+        return self.position >= len(self.batches)
+
+    @property
+    def round(self) -> int:
+        return self.simulator.state.round
+
+    def step(self) -> list:
+        round = self.round
+        results = self.simulator.apply_actions(self.batches[self.position])
+        self.position += 1
+        if self.round != round:
+            self._checkpoint()
+        return results
+
+    def run(self) -> Simulator:
+        if not self.checkpoint_every:
+            # no rounds to watch
+            apply_actions = self.simulator.apply_actions
+            for batch in self.batches[self.position:]:
+                apply_actions(batch)
+            self.position = len(self.batches)
+            return self.simulator
+        while not self.done:
+            self.step()
+        return self.simulator
+
+    def seek(self, round: int) -> Simulator:
+        # to the start of battle round, or the end if the campaign stopped before
+        nearest = max((r for r in self.checkpoints if r <= round), default=min(self.checkpoints))
+        if not nearest < self.round < round:
+            self._restore(self.checkpoints[nearest])
+        while not self.done and self.round < round:
+            self.step()
+        return self.simulator
+
+    def _checkpoint(self, force: bool = False):
+        round = self.round
+        if round in self.checkpoints:
+            return
+        if not force and (not self.checkpoint_every or round % self.checkpoint_every):
+            return
+        self.checkpoints[round] = Checkpoint(
+            self.position,
+            self.simulator.state.serialize(),
+            [rng.getstate() for rng in self.rngs],
+            list(self.simulator.last_fight_monsters),
+        )
+
+    def _restore(self, checkpoint: Checkpoint):
+        simulator = self.simulator
+        simulator.state.deserialize(checkpoint.state)
+        for rng, rng_state in zip(self.rngs, checkpoint.rng_states):
+            rng.setstate(rng_state)
+        simulator.last_fight_monsters = list(checkpoint.last_fight_monsters)
+        if simulator.undo_log is not None:
+            simulator.undo_log.clear()
+        if simulator.zobrist is not None:
+            simulator.zobrist.reset(simulator.state)
+        self.position = checkpoint.position
+
+
+def write_replays(path: str, replays) -> int:
+    count = 0
+    with open(path, 'ab') as f:
+        for replay in replays:
+            f.write(replay.to_bytes())
+            count += 1
+    return count
+
+
+def read_replays(path: str, offset: int = 0, count: Optional[int] = None) -> Iterator[Replay]:
+    # One replay at a time from offset, reading only what the count asks for
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while count != 0:
+            header = f.read(HEADER.size)
+            if not header:
+                break
+            _, _, _, _, settings_length, actions_length = HEADER.unpack(header)
+            replay, _ = Replay.from_bytes(header + f.read(settings_length + actions_length))
+            yield replay
+            if count is not None:
+                count -= 1
+
+
+def chunk_offsets(path: str, chunk: int) -> List[Tuple[int, int, int]]:
+    # (first index, byte offset, count) of every chunk replays, from the headers alone
+    chunks = []
+    index = 0
+    offset = 0
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while offset < size:
+            if index % chunk == 0:
+                chunks.append([index, offset, 0])
+            f.seek(offset)
+            header = HEADER.unpack(f.read(HEADER.size))
+            offset += HEADER.size + header[4] + header[5]
+            chunks[-1][2] += 1
+            index += 1
+    return [tuple(entry) for entry in chunks]
+
+
+def record_campaigns(runs: int, seed: int, bot_factory: Optional[Callable] = None) -> Iterator[Replay]:
+    import bot
+    from runner import campaign_seed
+
+    recorder = Recorder()
+    player = (bot_factory or bot.Bot)()
+    # the bot's own options, recorded in every replay's flags
+    simulator = player.simulator
+    player.simulator = Simulator(undo=simulator.undo_log is not None, streams=simulator.streams, recorder=recorder)
+    for index in range(runs):
+        player.run({'seed': campaign_seed(seed, index)})
+        yield recorder.replay()
+
+
+def _scan_chunk(args) -> List[int]:
+    path, first, offset, count, predicate = args
+    return [
+        first + index for index, replay in enumerate(read_replays(path, offset, count))
+        if predicate(Replayer(replay, checkpoint_every=0).run())
+    ]
+
+
+def scan(path: str, predicate: Callable[[Simulator], bool], workers: int = 1, chunk: int = 10000) -> List[int]:
+    # Indices of the replays whose final simulator satisfies predicate, which
+    # must be picklable when workers > 1
+    jobs = [(path, first, offset, count, predicate) for first, offset, count in chunk_offsets(path, chunk)]
+    if workers == 1:
+        return [index for job in jobs for index in _scan_chunk(job)]
+    with multiprocessing.Pool(workers) as pool:
+        return [index for found in pool.map(_scan_chunk, jobs) for index in found]
+
+
+class RoundBelow:
+    # Picklable predicate: the campaign ended before this round
+    def __init__(self, round: int):
+        self.round = round
+
+    def __call__(self, simulator: Simulator) -> bool:
+        return simulator.state.round < self.round
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record = subparsers.add_parser('record')
+    record.add_argument('path')
+    record.add_argument('--runs', type=int, default=1000)
+    record.add_argument('--seed', type=int, default=0)
+    show = subparsers.add_parser('show')
+    show.add_argument('path')
+    show.add_argument('index', type=int)
+    show.add_argument('--round', type=int, default=None)
+    find = subparsers.add_parser('scan')
+    find.add_argument('path')
+    find.add_argument('--round-below', type=int, default=20)
+    find.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        count = write_replays(args.path, record_campaigns(args.runs, args.seed))
+        print(f'{count} replays, {os.path.getsize(args.path)} bytes')
+    elif args.command == 'show':
+        for index, replay in enumerate(read_replays(args.path)):
+            if index == args.index:
+                replayer = Replayer(replay)
+                simulator = replayer.seek(args.round) if args.round is not None else replayer.run()
+                print(f'seed {replay.seed}  {len(replayer.batches)} batches  {len(replay.actions)} bytes')
+                print(simulator.state)
+                break
+    else:
+        found = scan(args.path, RoundBelow(args.round_below), workers=args.workers)
+        print(f'{len(found)} replays ended before round {args.round_below}: {found[:20]}')
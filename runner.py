@@ -0,0 +1,205 @@
+import collections
+import dataclasses
+import functools
+import multiprocessing
+import os
+import random
+import time
+from typing import Callable, Counter, Hashable, Optional, Tuple
+
+from bot import Bot
+
+
+LAST_ROUND = 20
+CHUNKS_PER_WORKER = 4
+# serial campaigns played first to measure single-worker throughput, at
+# most 1 / (workers + 1) of the run so the pool always gets the larger share
+CALIBRATION_RUNS = 50
+CALIBRATION_TIME = 1.0
+
+
+def campaign_seed(seed: int, index: int) -> int:
+    # Every campaign owns its stream, so chunking and worker count don't matter
+    return (seed << 32) | index
+
+
+@dataclasses.dataclass
+class RunStats:
+    runs: int = 0
+    wins: int = 0
+    rounds: Counter[int] = dataclasses.field(default_factory=collections.Counter)
+    loss_monsters: Counter[Tuple[str, ...]] = dataclasses.field(default_factory=collections.Counter)
+    seed: int = 0
+    workers: int = 1
+    busy_time: float = 0.0
+    wall_time: float = 0.0
+    # campaigns per second of one worker alone and of all the workers
+    serial_rate: float = 0.0
+    parallel_rate: float = 0.0
+    # search bots only, see mcts.MCTSBot
+    rollouts: int = 0
+    search_time: float = 0.0
+
+    def add(self, round: int, last_fight_monsters):
+        self.runs += 1
+        self.rounds[round] += 1
+        if round == LAST_ROUND:
+            self.wins += 1
+        else:
+            self.loss_monsters[tuple(sorted(last_fight_monsters))] += 1
+
+    def merge(self, other: 'RunStats'):
+        self.runs += other.runs
+        self.wins += other.wins
+        self.rounds.update(other.rounds)
+        self.loss_monsters.update(other.loss_monsters)
+        self.busy_time += other.busy_time
+        self.rollouts += other.rollouts
+        self.search_time += other.search_time
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.runs if self.runs else 0.0
+
+    @property
+    def speedup(self) -> Optional[float]:
+        # throughput against one worker, so contention counts against it;
+        # None when either rate wasn't measured
+        if not self.serial_rate or not self.parallel_rate:
+            return None
+        return self.parallel_rate / self.serial_rate
+
+    @property
+    def efficiency(self) -> Optional[float]:
+        speedup = self.speedup
+        return speedup / self.workers if speedup is not None and self.workers else None
+
+    @property
+    def rollouts_per_second(self) -> float:
+        return self.rollouts / self.search_time if self.search_time else 0.0
+
+    def summary(self) -> str:
+        speedup, efficiency = self.speedup, self.efficiency
+        lines = [
+            f'runs: {self.runs}  wins: {self.wins}  win rate: {self.win_rate:.4f}  seed: {self.seed}',
+            f'workers: {self.workers}  wall: {self.wall_time:.2f}s  busy: {self.busy_time:.2f}s  '
+            f'speedup: {"n/a" if speedup is None else f"{speedup:.2f}x"}  '
+            f'efficiency: {"n/a" if efficiency is None else f"{efficiency:.1%}"}  '
+            f'campaigns/s: {self.serial_rate:.1f} serial, {self.parallel_rate:.1f} parallel',
+            'rounds: ' + ' '.join(f'{r}:{n}' for r, n in sorted(self.rounds.items())),
+        ]
+        if self.rollouts:
+            lines.append(
+                f'rollouts: {self.rollouts}  search: {self.search_time:.2f}s  '
+                f'rollouts/s: {self.rollouts_per_second:.0f}'
+            )
+        for monsters, count in self.loss_monsters.most_common(5):
+            lines.append(f'lost to {", ".join(monsters)}: {count}')
+        return '\n'.join(lines)
+
+
+def factory_key(bot_factory: Callable[[], Bot]) -> Hashable:
+    # What the factory builds, stable across pickling: a pool worker gets a
+    # new partial object for every chunk, equal to the last one
+    if isinstance(bot_factory, functools.partial):
+        return (
+            factory_key(bot_factory.func),
+            bot_factory.args,
+            tuple(sorted(bot_factory.keywords.items())),
+        )
+    return bot_factory.__module__, bot_factory.__qualname__
+
+
+# (factory_key, bot) of the bot this process reuses across chunks
+_bot: Optional[Tuple[Hashable, Bot]] = None
+
+
+def worker_bot(bot_factory: Callable[[], Bot]) -> Bot:
+    # One bot per process: a chunk with another factory closes the old one,
+    # so memory doesn't grow with the number of chunks
+    global _bot
+    key = factory_key(bot_factory)
+    if _bot is not None and _bot[0] == key:
+        return _bot[1]
+    close_bots()
+    bot = bot_factory()
+    _bot = key, bot
+    return bot
+
+
+def close_bots():
+    global _bot
+    if _bot is not None:
+        _bot[1].close()
+        _bot = None
+
+
+def _run_chunk(bot_factory: Callable[[], Bot], seed: int, start: int, stop: int) -> RunStats:
+    bot = worker_bot(bot_factory)
+    stats = RunStats(seed=seed)
+    # CPU time, so oversubscribed workers don't inflate the speedup
+    began = time.process_time()
+    rollouts = getattr(bot, 'rollouts_done', 0)
+    search_time = getattr(bot, 'search_time', 0.0)
+    for index in range(start, stop):
+        round, last_fight_monsters = bot.run({'seed': campaign_seed(seed, index)})
+        stats.add(round, last_fight_monsters)
+    stats.busy_time = time.process_time() - began
+    stats.rollouts = getattr(bot, 'rollouts_done', 0) - rollouts
+    stats.search_time = getattr(bot, 'search_time', 0.0) - search_time
+    return stats
+
+
+def _run_chunk_args(args) -> RunStats:
+    return _run_chunk(*args)
+
+
+def run(
+    runs: int,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+    bot_factory: Callable[[], Bot] = Bot,
+) -> RunStats:
+    workers = workers or os.cpu_count() or 1
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+
+    stats = RunStats(seed=seed, workers=workers)
+    began = time.perf_counter()
+    if workers == 1:
+        chunks_count = min(runs, CHUNKS_PER_WORKER) or 1
+        bounds = [runs * i // chunks_count for i in range(chunks_count + 1)]
+        try:
+            for i in range(chunks_count):
+                stats.merge(_run_chunk(bot_factory, seed, bounds[i], bounds[i + 1]))
+        finally:
+            close_bots()
+        stats.wall_time = time.perf_counter() - began
+        stats.serial_rate = stats.parallel_rate = runs / stats.wall_time if stats.wall_time else 0.0
+        return stats
+
+    # The first campaigns run here, one at a time, for the serial rate
+    calibrated = 0
+    calibration_runs = min(runs // (workers + 1), CALIBRATION_RUNS)
+    try:
+        while calibrated < calibration_runs and time.perf_counter() - began < CALIBRATION_TIME:
+            stats.merge(_run_chunk(bot_factory, seed, calibrated, calibrated + 1))
+            calibrated += 1
+    finally:
+        close_bots()
+    calibration_time = time.perf_counter() - began
+    stats.serial_rate = calibrated / calibration_time if calibrated else 0.0
+
+    remaining = runs - calibrated
+    chunks_count = min(remaining, workers * CHUNKS_PER_WORKER) or 1
+    bounds = [calibrated + remaining * i // chunks_count for i in range(chunks_count + 1)]
+    chunks = [(bot_factory, seed, bounds[i], bounds[i + 1]) for i in range(chunks_count)]
+    parallel_began = time.perf_counter()
+    if remaining:
+        with multiprocessing.Pool(workers) as pool:
+            for chunk_stats in pool.imap_unordered(_run_chunk_args, chunks):
+                stats.merge(chunk_stats)
+    parallel_time = time.perf_counter() - parallel_began
+    stats.parallel_rate = remaining / parallel_time if remaining else 0.0
+    stats.wall_time = time.perf_counter() - began
+    return stats
@@ -1,16 +1,76 @@
-from bot import Bot
+import argparse
+import functools
+
+import pipeline
+import runner
+import sequential
+from bot import Bot, ExpectimaxBot
+from mcts import MCTSBot
 
 
 if __name__ == '__main__':
-    bot = Bot()
-    success = 0
-    for _ in range(1000):
-        round, last_fight_monsters = bot.run()
-        if round == 20:
-            success += 1
-            # print("win: ", end = ' ')
-            # print(last_fight_monsters)
-        # else:
-            # print("lose: ", end=' ')
-            # print(last_fight_monsters)
-    print(success)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--summary', action='store_true')
+    parser.add_argument('--bot', choices=('heuristic', 'expectimax', 'mcts'), default='heuristic')
+    parser.add_argument('--horizon', type=int, default=0, help='turns the expectimax bot enumerates after the current one')
+    parser.add_argument('--rollouts', type=int, default=100)
+    parser.add_argument('--time-limit', type=float, default=None)
+    parser.add_argument('--search-workers', type=int, default=1)
+    parser.add_argument('--records', help='append one JSON line per campaign and keep only running aggregates')
+    # sequential estimation: --runs becomes the budget
+    parser.add_argument('--precision', type=float, default=None, help='stop at this interval half-width')
+    parser.add_argument('--threshold', type=float, default=None, help='stop once the SPRT places the win rate')
+    parser.add_argument('--delta', type=float, default=0.02)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+    if args.bot == 'mcts' and args.workers > 1 and args.search_workers > 1:
+        # pool workers are daemonic and cannot start their own pools
+        parser.error('--search-workers > 1 needs --workers 1')
+
+    if args.bot == 'expectimax':
+        bot_factory = functools.partial(ExpectimaxBot, horizon=args.horizon)
+    elif args.bot == 'mcts':
+        bot_factory = functools.partial(
+            MCTSBot, rollouts=args.rollouts, time_limit=args.time_limit, workers=args.search_workers,
+        )
+    else:
+        bot_factory = Bot
+    if args.precision is not None or args.threshold is not None:
+        # one batch in flight, split across the workers, so stopping wastes
+        # at most a batch
+        stream = pipeline.records(
+            args.runs, workers=args.workers, seed=args.seed, bot_factory=bot_factory,
+            chunk_size=max(1, args.batch // args.workers), ahead=0,
+        )
+        sprt = (
+            sequential.SPRT(args.threshold, args.delta, args.alpha, args.beta)
+            if args.threshold is not None else None
+        )
+        writer = pipeline.RecordWriter(args.records) if args.records else None
+        try:
+            result = sequential.estimate(
+                stream, args.runs, batch=args.batch, precision=args.precision, sprt=sprt,
+                confidence=args.confidence, writer=writer,
+            )
+        finally:
+            if writer is not None:
+                writer.close()
+        print(result.summary())
+        if args.summary:
+            print(result.aggregates.summary())
+    else:
+        if args.records:
+            stream = pipeline.records(args.runs, workers=args.workers, seed=args.seed, bot_factory=bot_factory)
+            with pipeline.RecordWriter(args.records) as writer:
+                stats = pipeline.consume(stream, pipeline.Aggregates(), writer)
+        else:
+            stats = runner.run(args.runs, workers=args.workers, seed=args.seed, bot_factory=bot_factory)
+        print(stats.wins)
+        if args.summary:
+            print(stats.summary())
@@ -0,0 +1,127 @@
+import dataclasses
+import math
+import statistics
+from typing import Iterable, Optional, Tuple
+
+from pipeline import Aggregates, CampaignRecord, RecordWriter
+
+
+def z_score(confidence: float) -> float:
+    return statistics.NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+
+
+def wilson(wins: int, runs: int, confidence: float = 0.95) -> Tuple[float, float]:
+    # Wilson score interval of a binomial proportion, sane near 0 and 1
+    if not runs:
+        return 0.0, 1.0
+    z = z_score(confidence)
+    p = wins / runs
+    denominator = 1 + z * z / runs
+    center = (p + z * z / (2 * runs)) / denominator
+    half = z * math.sqrt(p * (1 - p) / runs + z * z / (4 * runs * runs)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+class SPRT:
+    # Wald's test of win rate <= threshold - delta (H0) against
+    # >= threshold + delta (H1), with error rates alpha and beta
+    def __init__(self, threshold: float, delta: float = 0.02, alpha: float = 0.05, beta: float = 0.05):
+        self.p0 = max(threshold - delta, 1e-9)
+        self.p1 = min(threshold + delta, 1 - 1e-9)
+        self.win_llr = math.log(self.p1 / self.p0)
+        self.loss_llr = math.log((1 - self.p1) / (1 - self.p0))
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+
+    def llr(self, wins: int, runs: int) -> float:
+        return wins * self.win_llr + (runs - wins) * self.loss_llr
+
+    def decide(self, wins: int, runs: int) -> Optional[bool]:
+        # True above the threshold, False below, None to keep going
+        llr = self.llr(wins, runs)
+        if llr >= self.upper:
+            return True
+        if llr <= self.lower:
+            return False
+        return None
+
+
+@dataclasses.dataclass
+class Estimate:
+    aggregates: Aggregates
+    budget: int
+    confidence: float
+    stopped_by: str = 'budget'
+    # SPRT verdict, None without a threshold or when the budget ran out first
+    above: Optional[bool] = None
+    # campaigns played, with those still in flight when the estimate stopped
+    simulated: int = 0
+
+    @property
+    def runs(self) -> int:
+        return self.aggregates.runs
+
+    @property
+    def wins(self) -> int:
+        return self.aggregates.wins
+
+    @property
+    def interval(self) -> Tuple[float, float]:
+        return wilson(self.wins, self.runs, self.confidence)
+
+    @property
+    def saved(self) -> int:
+        return self.budget - self.simulated
+
+    def summary(self) -> str:
+        low, high = self.interval
+        lines = [
+            f'win rate: {self.aggregates.win_rate:.4f}  {self.confidence:.0%} interval: [{low:.4f}, {high:.4f}]',
+            f'campaigns: {self.runs} used, {self.simulated} simulated of {self.budget}  saved: {self.saved} '
+            f'({self.budget / self.simulated if self.simulated else 0:.1f}x)  stopped by: {self.stopped_by}',
+        ]
+        if self.above is not None:
+            lines.append(f'SPRT: win rate is {"above" if self.above else "below"} the threshold')
+        return '\n'.join(lines)
+
+
+def estimate(
+    stream: Iterable[CampaignRecord],
+    budget: int,
+    batch: int = 100,
+    precision: Optional[float] = None,
+    sprt: Optional[SPRT] = None,
+    confidence: float = 0.95,
+    writer: Optional[RecordWriter] = None,
+) -> Estimate:
+    # Reads the stream in batches and stops at the first batch where the
+    # interval's half-width is within precision or the SPRT decides.
+    # Checking only between batches keeps the SPRT error rates close to
+    # nominal; they are slightly conservative. The stream is closed at the
+    # end; a pipeline.RecordStream reports how many campaigns it really
+    # played, chunks cut short included.
+    result = Estimate(Aggregates(), budget, confidence)
+    aggregates = result.aggregates
+    for record in stream:
+        aggregates.add(record)
+        if writer is not None:
+            writer.write(record)
+        runs = aggregates.runs
+        if runs % batch and runs < budget:
+            continue
+        if sprt is not None:
+            result.above = sprt.decide(aggregates.wins, runs)
+            if result.above is not None:
+                result.stopped_by = 'sprt'
+                break
+        if precision is not None:
+            low, high = result.interval
+            if (high - low) / 2 <= precision:
+                result.stopped_by = 'precision'
+                break
+        if runs >= budget:
+            break
+    if hasattr(stream, 'close'):
+        stream.close()
+    result.simulated = getattr(stream, 'simulated', aggregates.runs)
+    return result
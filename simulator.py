@@ -1,11 +1,17 @@
 import abc
 import enum
 import random
-import uuid
-from typing import List, Optional, OrderedDict
+from typing import TYPE_CHECKING, List, Optional
 
 import library
-from state import Phase, SimulatorState, HeroState, MonsterState, HeroID, MonsterID, PositionState, Row
+import profiler
+import zobrist
+from state import (
+    Phase, SimulatorState, HeroState, MonsterState, HeroID, MonsterID, SlotAllocator,
+)
+
+if TYPE_CHECKING:
+    from replay import Recorder
 
 
 class ActionType(enum.Enum):
@@ -30,32 +36,153 @@ class Action(abc.ABC):
     # def can_apply(self):
     #     pass
 
+    @classmethod
+    def journal_removal(cls, state, targetID, positions_field: str, tables):
+        positions = getattr(state, positions_field)
+        position_state = positions[targetID]
+        characterIDs = [targetID] + [
+            characterID for characterID in (position_state.left, position_state.right)
+            if characterID is not None
+        ]
+        state.journal.append((UNDO_POSITIONS, positions_field, [
+            (characterID, positions[characterID].dead, positions[characterID].left, positions[characterID].right)
+            for characterID in characterIDs
+        ]))
+        for field in tables:
+            cls.journal_table(state, field)
+
     @classmethod
     def check_and_remove_target(cls, state, targetID):
         if targetID in state.monsters:
             monster = state.monsters[targetID]
             if monster.health <= 0:
-                state.monsters_position[targetID].dead = True
+                if state.journal is not None:
+                    cls.journal_removal(state, targetID, 'monsters_position', ('monsters', 'monster_sides'))
+                if state.zobrist is not None:
+                    h = state.zobrist
+                    h.value ^= h.character(targetID, monster)
+                    if targetID in state.monster_sides:
+                        h.value ^= h.key(zobrist.MONSTER_SIDE, targetID, state.monster_sides[targetID])
+                state.monsters_position.mark_dead(targetID)
                 del state.monsters[targetID]
                 del state.monster_sides[targetID]
         elif targetID in state.heroes:
             hero = state.heroes[targetID]
             if hero.health <= 0:
-                state.heroes_position[targetID].dead = True
+                if state.journal is not None:
+                    cls.journal_removal(
+                        state, targetID, 'heroes_position', ('heroes', 'table_sides', 'saved_sides'),
+                    )
+                if state.zobrist is not None:
+                    h = state.zobrist
+                    h.value ^= h.character(targetID, hero)
+                    if targetID in state.table_sides:
+                        h.value ^= h.key(zobrist.TABLE_SIDE, targetID, state.table_sides[targetID])
+                    if targetID in state.saved_sides:
+                        h.value ^= h.key(zobrist.SAVED_SIDE, targetID, state.saved_sides[targetID])
+                state.heroes_position.mark_dead(targetID)
                 del state.heroes[targetID]
                 if targetID in state.table_sides:
                     del state.table_sides[targetID]
                 if targetID in state.saved_sides:
                     del state.saved_sides[targetID]
 
+    @classmethod
+    def journal_character(cls, state, characterID, character_state):
+        state.journal.append((
+            UNDO_CHARACTER,
+            characterID,
+            character_state.health,
+            character_state.shield,
+            character_state.disabled,
+            [getattr(character_state, effect) for effect in library.EFFECTS],
+        ))
+
+    @classmethod
+    def journal_table(cls, state, field: str):
+        state.journal.append((UNDO_TABLE, field, list(getattr(state, field).items())))
+
+    @classmethod
+    def apply_opcode(cls, state, opcode: library.Opcode, selfID, targetID):
+        kind, pip, keywords = opcode
+        journal = state.journal
+        h = state.zobrist
+        characters = state.monsters
+        target_state = characters.get(targetID)
+        if target_state is None:
+            characters = state.heroes
+            target_state = characters.get(targetID)
+
+        if target_state is not None:
+            if journal is not None:
+                cls.journal_character(state, targetID, target_state)
+            if h is not None:
+                h.value ^= h.character(targetID, target_state)
+            if kind == library.OP_SWORD:
+                if library.Character.takeDamage(target_state, pip):
+                    state.dying.append(targetID)
+            else:
+                library.Character.addShield(target_state, pip)
+            # petrify, cleave, then death, like the keyword classes
+            if keywords & library.KEYWORD_PETRIFY:
+                library.Character.petrify(target_state)
+            if h is not None:
+                h.value ^= h.character(targetID, target_state)
+
+        if not keywords:
+            return
+        if target_state is not None and keywords & library.KEYWORD_CLEAVE:
+            positions = state.monsters_position if characters is state.monsters else state.heroes_position
+            for neighbourID in (positions.neighbour(targetID, 1), positions.neighbour(targetID, -1)):
+                if neighbourID is None:
+                    continue
+                neighbour_state = characters[neighbourID]
+                if journal is not None:
+                    cls.journal_character(state, neighbourID, neighbour_state)
+                if h is not None:
+                    h.value ^= h.character(neighbourID, neighbour_state)
+                if kind == library.OP_SWORD:
+                    if library.Character.takeDamage(neighbour_state, pip):
+                        state.dying.append(neighbourID)
+                else:
+                    library.Character.addShield(neighbour_state, pip)
+                if h is not None:
+                    h.value ^= h.character(neighbourID, neighbour_state)
+        if keywords & library.KEYWORD_DEATH:
+            self_state = state.monsters.get(selfID) or state.heroes.get(selfID)
+            if self_state is None:
+                return
+            if journal is not None:
+                cls.journal_character(state, selfID, self_state)
+            if h is not None:
+                h.value ^= h.character(selfID, self_state)
+            if library.Character.die(self_state):
+                state.dying.append(selfID)
+            if h is not None:
+                h.value ^= h.character(selfID, self_state)
+
+    @classmethod
+    def remove_dying(cls, state):
+        # Only characters whose health crossed zero since the last call
+        for targetID in state.dying:
+            cls.check_and_remove_target(state, targetID)
+        state.dying.clear()
+
 
 class ActionBattleSaveSide(Action):
     def __init__(self, heroes: List[HeroID]):
         self.heroes = heroes
 
     def apply(self, state) -> library.Result:
+        if state.journal is not None:
+            Action.journal_table(state, 'table_sides')
+            Action.journal_table(state, 'saved_sides')
+        h = state.zobrist
         for heroID in self.heroes:
             if heroID in state.table_sides:
+                if h is not None:
+                    sideID = state.table_sides[heroID]
+                    h.value ^= h.key(zobrist.TABLE_SIDE, heroID, sideID) ^ h.key(zobrist.SAVED_SIDE, heroID, sideID)
                 state.saved_sides[heroID] = state.table_sides[heroID]
                 del state.table_sides[heroID]
             else:
@@ -73,22 +200,9 @@ class ActionBattleApplySide(Action):
         if not library.Character.can_side_be_used(hero_state, self.sideID):
             return library.Result(True)
 
-        # apply side logic
-        side_state = hero_state.sides[self.sideID]
-        side_cls = library.Side.get_cls(side_state.name)
-        side_cls.apply(state, side_state, self.targetID)
-        # apply keywords logic
-        for k_state in side_state.keywords.values():
-            k_cls = library.Keyword.get_cls(k_state.name)
-            k_cls.apply(state, side_state, self.heroID, self.targetID)
-
-        # TODO: inefficient
-        for heroID in list(state.heroes.keys()):
-            Action.check_and_remove_target(state, heroID)
-        for monsterID in list(state.monsters.keys()):
-            Action.check_and_remove_target(state, monsterID)
-        # Action.check_and_remove_target(state, self.heroID)
-        # Action.check_and_remove_target(state, self.targetID)
+        opcode = library.OPCODES[hero_state.name][self.sideID]
+        Action.apply_opcode(state, opcode, self.heroID, self.targetID)
+        Action.remove_dying(state)
 
         return library.Result(True)
 
@@ -105,34 +219,70 @@ class ActionBattleEndTurn(Action):
             monster = state.monsters.get(monsterID)
             if monster is None:
                 continue
-            sideID = state.monster_sides[monsterID]
-            side_state = monster.sides[sideID]
-            side_cls = library.Side.get_cls(side_state.name)
-            targetID = state.monster_attacks[monsterID][0]
-            side_cls.apply(state, side_state, targetID)
-
-            # apply keyword logic
-            for k_state in side_state.keywords.values():
-                k_cls = library.Keyword.get_cls(k_state.name)
-                k_cls.apply(state, side_state, monsterID, targetID)
-
-            # TODO: inefficient
-            for heroID in list(state.heroes.keys()):
-                Action.check_and_remove_target(state, heroID)
-            for monsterID in list(state.monsters.keys()):
-                Action.check_and_remove_target(state, monsterID)
-            # Action.check_and_remove_target(state, targetID)
-            # Action.check_and_remove_target(state, monsterID)
+            opcode = library.OPCODES[monster.name][state.monster_sides[monsterID]]
+            Action.apply_opcode(state, opcode, monsterID, state.monster_attacks[monsterID][0])
+            Action.remove_dying(state)
+
+        self.clear_turn(state)
+        return library.Result(True)
 
+    @classmethod
+    def clear_turn(cls, state):
+        if state.zobrist is not None:
+            state.zobrist.value ^= state.zobrist.sides(state) ^ state.zobrist.attacks(state)
         state.saved_sides.clear()
         state.table_sides.clear()
         state.monster_sides.clear()
         state.monster_attacks.clear()
 
+
+class _TimedApplySide(ActionBattleApplySide):
+    # ActionBattleApplySide with its opcode on its own profile frame, see
+    # Simulator(profile=)
+    def __init__(self, action: ActionBattleApplySide, profile: profiler.Profile):
+        super().__init__(action.heroID, action.sideID, action.targetID)
+        self.profile = profile
+
+    def apply(self, state):
+        hero_state = state.heroes[self.heroID]
+        if not library.Character.can_side_be_used(hero_state, self.sideID):
+            return library.Result(True)
+
+        opcode = library.OPCODES[hero_state.name][self.sideID]
+        self.profile.enter(self.profile.label(opcode))
+        Action.apply_opcode(state, opcode, self.heroID, self.targetID)
+        Action.remove_dying(state)
+        self.profile.exit()
+
+        return library.Result(True)
+
+
+class _TimedEndTurn(ActionBattleEndTurn):
+    # ActionBattleEndTurn with every monster's opcode on its own profile frame
+    def __init__(self, action: ActionBattleEndTurn, profile: profiler.Profile):
+        self.profile = profile
+
+    def apply(self, state):
+        profile = self.profile
+        for monsterID in list(state.monsters.keys()):
+            monster = state.monsters.get(monsterID)
+            if monster is None:
+                continue
+            opcode = library.OPCODES[monster.name][state.monster_sides[monsterID]]
+            profile.enter(profile.label(opcode))
+            Action.apply_opcode(state, opcode, monsterID, state.monster_attacks[monsterID][0])
+            Action.remove_dying(state)
+            profile.exit()
+
+        self.clear_turn(state)
         return library.Result(True)
 
 
 class ActionBattleUndo(Action):
+    # Applied by Simulator.apply_actions, which owns the undo log
+    def __init__(self, count: int = 1):
+        self.count = count
+
     def apply(self, state):
         pass
 
@@ -143,10 +293,145 @@ class ActionLevelUp(Action):
         return library.Result(True)
 
 
+# (kind, characterID, health, shield, disabled, [value per library.EFFECTS])
+UNDO_CHARACTER = 0
+UNDO_TABLE = 1
+UNDO_POSITIONS = 2
+UNDO_SNAPSHOT = 3
+
+
+class UndoLog:
+    # One entry per applied action. Saving and applying sides journal the few
+    # fields they touch, by ID; other actions and phase changes store a
+    # snapshot and the RNG state, so undoing them also replays the same dice.
+    LIGHT_ACTIONS = (ActionBattleSaveSide, ActionBattleApplySide)
+
+    def __init__(self, simulator: 'Simulator', rngs: List[random.Random]):
+        # snapshots also keep the simulator's last_fight_monsters
+        self.simulator = simulator
+        self.rngs = rngs
+        self.entries: List[list] = []
+
+    def clear(self):
+        self.entries.clear()
+
+    def begin(self, state: SimulatorState, action: Action):
+        if isinstance(action, self.LIGHT_ACTIONS):
+            entry = []
+            state.journal = entry
+        else:
+            entry = [self._snapshot(state)]
+        self.entries.append(entry)
+
+    def end(self, state: SimulatorState):
+        state.journal = None
+
+    def before_phase_change(self, state: SimulatorState, entries_count: int):
+        if len(self.entries) == entries_count:
+            self.entries.append([])
+        self.entries[-1].append(self._snapshot(state))
+
+    def undo(self, state: SimulatorState, count: int = 1) -> library.Result:
+        if len(self.entries) < count:
+            return library.Result(False, 'Nothing to undo')
+        for _ in range(count):
+            for record in reversed(self.entries.pop()):
+                self._restore(state, record)
+        return library.Result(True)
+
+    def _snapshot(self, state: SimulatorState) -> tuple:
+        return (
+            UNDO_SNAPSHOT,
+            state.serialize(),
+            [rng.getstate() for rng in self.rngs],
+            list(self.simulator.last_fight_monsters),
+        )
+
+    def _restore(self, state: SimulatorState, record: tuple):
+        kind = record[0]
+        if kind == UNDO_CHARACTER:
+            _, characterID, health, shield, disabled, effects = record
+            character_state = state.heroes.get(characterID) or state.monsters[characterID]
+            character_state.health = health
+            character_state.shield = shield
+            character_state.disabled = disabled
+            for effect, value in zip(library.EFFECTS, effects):
+                setattr(character_state, effect, value)
+        elif kind == UNDO_TABLE:
+            _, field, items = record
+            table = getattr(state, field)
+            table.clear()
+            table.update(items)
+        elif kind == UNDO_POSITIONS:
+            _, field, positions = record
+            formation = getattr(state, field)
+            for characterID, dead, left, right in positions:
+                position_state = formation[characterID]
+                position_state.dead = dead
+                position_state.left = left
+                position_state.right = right
+        else:
+            _, data, rng_states, last_fight_monsters = record
+            state.deserialize(data)
+            for rng, rng_state in zip(self.rngs, rng_states):
+                rng.setstate(rng_state)
+            self.simulator.last_fight_monsters = last_fight_monsters
+
+
+SIDE_INDICES = range(6)
+
+# Independent random streams of a simulator built with streams=True
+STREAMS = ('spawn', 'roll', 'attack', 'level_up')
+
+ACTION_TYPES = {
+    ActionLevelUp: ActionType.LEVEL_UP,
+    ActionBattleSaveSide: ActionType.BATTLE_SAVE_SIDE,
+    ActionBattleApplySide: ActionType.BATTLE_APPLY_SIDE,
+    ActionBattleReroll: ActionType.BATTLE_REROLL,
+    ActionBattleEndTurn: ActionType.BATTLE_END_TURN,
+    ActionBattleUndo: ActionType.BATTLE_UNDO,
+}
+
+TIMED_ACTIONS = {
+    ActionBattleApplySide: _TimedApplySide,
+    ActionBattleEndTurn: _TimedEndTurn,
+}
+
+
 class Simulator:
-    def __init__(self):
+    def __init__(
+        self,
+        rng: Optional[random.Random] = None,
+        seed: Optional[int] = None,
+        undo: bool = False,
+        zobrist_seed: Optional[int] = None,
+        profile: Optional[profiler.Profile] = None,
+        streams: bool = False,
+        recorder: Optional['Recorder'] = None,
+    ):
+        self.rng = rng if rng is not None else random.Random(seed)
+        # With streams, monster spawns, dice, monster targets and hero draws
+        # each have their own RNG, reseeded from the campaign seed at every
+        # battle. Two bots then meet the same monsters and offers in the same
+        # round, and the same dice while their parties match, whatever they
+        # did before. Without, everything shares self.rng.
+        self.streams = streams
+        self.stream_seed = None
+        if streams:
+            self.stream_rngs = {name: random.Random() for name in STREAMS}
+        else:
+            self.stream_rngs = dict.fromkeys(STREAMS, self.rng)
+        self.spawn_rng = self.stream_rngs['spawn']
+        self.roll_rng = self.stream_rngs['roll']
+        self.attack_rng = self.stream_rngs['attack']
+        self.level_up_rng = self.stream_rngs['level_up']
+        self.undo_log = UndoLog(self, list(self.stream_rngs.values()) if streams else [self.rng]) if undo else None
         self.state = SimulatorState()
-        self.heroesLib = library.HeroLib()
+        # incremental hash of the state, off unless a key seed is given
+        self.zobrist = zobrist.Zobrist(zobrist_seed) if zobrist_seed is not None else None
+        self.state.zobrist = self.zobrist
+        self.slots = SlotAllocator()
+        self.heroesLib = library.HeroLib(rng=self.level_up_rng)
         self.monstersLib = library.MonsterLib()
         self.actions = []
         self.settings = {}
@@ -158,58 +443,133 @@ class Simulator:
             Phase.FINISHED: self._move_to_finished,
         }
         self.last_fight_monsters = []
+        # Profiling swaps in timed methods here, so a plain simulator pays nothing
+        self.profile = profile
+        if profile is not None:
+            self._apply_action = self._profiled_apply_action
+            self._roll = self._profiled_roll
+            self.move_to = {phase: self._profiled_move(phase, move) for phase, move in self.move_to.items()}
+        # the same for recording, see replay.Recorder
+        self.recorder = recorder
+        if recorder is not None:
+            self.apply_actions = recorder.wrap(self.apply_actions)
 
     def set_up(self, settings):
         self.settings = settings
+        if self.recorder is not None:
+            self.recorder.begin(self, settings)
+        if 'seed' in settings:
+            self.rng.seed(settings['seed'])
+        if self.streams:
+            self.stream_seed = settings['seed'] if 'seed' in settings else self.rng.getrandbits(64)
+            self._seed_streams(0)
+        self.heroesLib.set_up(settings)
+        if self.undo_log is not None:
+            self.undo_log.clear()
         self.state.phase = Phase.NONE
         self.state.round = 0
         self.state.heroes_name = [self.heroesLib.getHeroBy(level=1).name for _ in range(5)]
 
         # self.state.items = []
-        self._move_to_battle()
+        self.move_to[Phase.BATTLE]()
 
     def apply_actions(self, actions: List[Action]) -> List[library.Result]:
-        state = self.state
+        undo_log = self.undo_log
+        entries_count = len(undo_log.entries) if undo_log is not None else 0
         results = []
         for action in actions:
-            if not self._is_action_applicable(action):
-                results.apand(library.Result(False, 'Is not applicable'))
-                continue
-            # TODO
-            if isinstance(action, ActionBattleReroll):
-                self._roll()
-                results.append(library.Result(True))
-                continue
+            results.append(self._apply_action(action))
+            if undo_log is not None and isinstance(action, ActionBattleUndo):
+                entries_count = len(undo_log.entries)
 
-            actionResult = action.apply(self.state)
+        self._change_phase(entries_count)
+        return results
 
-            # TODO
-            if isinstance(action, ActionBattleEndTurn):
-                if len(state.monsters) != 0 and len(state.heroes) != 0:
-                    self._roll()
-                    self._generate_monster_attacks()
+    def _apply_action(self, action: Action) -> library.Result:
+        state = self.state
+        undo_log = self.undo_log
+        if not self._is_action_applicable(action):
+            return library.Result(False, 'Is not applicable')
+        if isinstance(action, ActionBattleUndo):
+            if undo_log is None:
+                return library.Result(False, 'Undo log is disabled')
+            result = undo_log.undo(state, action.count)
+            if self.zobrist is not None:
+                self.zobrist.reset(state)
+            return result
+        if undo_log is not None:
+            undo_log.begin(state, action)
+        # TODO
+        if isinstance(action, ActionBattleReroll):
+            self._roll()
+            return library.Result(True)
 
-            results.append(actionResult)
+        actionResult = action.apply(state)
+        if undo_log is not None:
+            undo_log.end(state)
 
+        # TODO
+        if isinstance(action, ActionBattleEndTurn):
+            if len(state.monsters) != 0 and len(state.heroes) != 0:
+                self._roll()
+                self._generate_monster_attacks()
+
+        return actionResult
+
+    def _profiled_apply_action(self, action: Action) -> library.Result:
+        # _apply_action on the action's own frame, with opcodes timed by the
+        # _Timed subclasses
+        profile = self.profile
+        profile.enter(profiler.ROOT, ACTION_TYPES.get(type(action), ActionType.NONE).name)
+        timed = TIMED_ACTIONS.get(type(action))
+        result = Simulator._apply_action(self, timed(action, profile) if timed is not None else action)
+        profile.exit()
+        return result
+
+    def _profiled_roll(self):
+        self.profile.enter(profiler.ROLL)
+        Simulator._roll(self)
+        self.profile.exit()
+
+    def _profiled_move(self, phase: Phase, move):
+        def timed():
+            self.profile.enter(profiler.MOVE_TO, f'{self.state.phase.name}->{phase.name}')
+            move()
+            self.profile.exit()
+        return timed
+
+    def _change_phase(self, entries_count: int):
+        state = self.state
         next_phase = self._should_change_phase_to()
         if next_phase:
+            if self.undo_log is not None:
+                self.undo_log.before_phase_change(state, entries_count)
             self.move_to[next_phase]()
+            if self.zobrist is not None:
+                self.zobrist.reset(state)
 
-        return results
+    def _seed_streams(self, round: int):
+        for name, rng in self.stream_rngs.items():
+            rng.seed(f'{self.stream_seed}:{name}:{round}')
 
     def _roll(self):
         state = self.state
+        h = self.zobrist
+        if h is not None:
+            h.value ^= h.sides(state)
         state.table_sides.clear()
+        # the whole turn's dice in one draw
+        rolls = iter(self.roll_rng.choices(SIDE_INDICES, k=len(state.heroes) + len(state.monsters)))
         for heroID, hero in state.heroes.items():
-            sideIndex = random.randint(0, 5)
             # TODO
-            side = hero.sides[sideIndex]
+            side = hero.sides[next(rolls)]
             state.table_sides[heroID] = side.id
         for monsterID, monster in state.monsters.items():
-            sideIndex = random.randint(0, 5)
             # TODO
-            side = monster.sides[sideIndex]
+            side = monster.sides[next(rolls)]
             state.monster_sides[monsterID] = side.id
+        if h is not None:
+            h.value ^= h.sides(state)
 
     def _is_action_applicable(self, action):
         # TODO
@@ -244,23 +604,19 @@ class Simulator:
         state = self.state
         state.phase = Phase.BATTLE
         state.round += 1
+        if self.streams:
+            self._seed_streams(state.round)
         state.saved_sides.clear()
         state.heroes.clear()
+        state.heroes_position.clear()
         state.monsters.clear()
         state.monsters_position.clear()
-        # python3.7 and higher has state.heroes always in the same order
-        state.heroes = {
-            str(uuid.uuid4()): self.heroesLib.getByName(name).dump_state()
-            for name in state.heroes_name
-        }
-        self.state.heroes_position = OrderedDict(tuple(
-            (heroID, PositionState(position=i, row=Row.FORWARD, dead=False))
-            for i, heroID in enumerate(list(state.heroes.keys()))
-        ))
-
-        for hero_position in state.heroes_position.values():
-            hero_position.dead = False
-            hero_position.row = Row.FORWARD
+        # IDs of the previous battle are free again; heroes take the lowest ones
+        self.slots.reset()
+        for name in state.heroes_name:
+            heroID = self.slots.acquire()
+            state.heroes[heroID] = self.heroesLib.getByName(name).instantiate()
+            state.heroes_position.append(heroID)
         self._generate_monsters(3)
 
         monsters_names = []
@@ -271,13 +627,15 @@ class Simulator:
         
         self._roll()
         self._generate_monster_attacks()
+        if self.zobrist is not None:
+            self.zobrist.reset(state)
 
     def _move_to_level_up(self):
         state = self.state
         state.phase = Phase.LEVEL_UP
         state.heroes_to_select.clear()
         heroes_to_change = (
-            random.sample(list(state.heroes.values()), 2)
+            self.level_up_rng.sample(list(state.heroes.values()), 2)
             if len(state.heroes) > 1
             else state.heroes.values()
         )
@@ -301,15 +659,20 @@ class Simulator:
             list(library.MonsterLib.ALL_MONSTERS.keys()),
         )
         for i in range(count):
-            monsterIndex = random.randint(0, len(allowed_monsters) - 1)
-            monsterID = str(uuid.uuid4())
-            monster = self.monstersLib.getByName(allowed_monsters[monsterIndex]).dump_state()
+            monsterIndex = self.spawn_rng.randrange(len(allowed_monsters))
+            monsterID = self.slots.acquire()
+            monster = self.monstersLib.getByName(allowed_monsters[monsterIndex]).instantiate()
             self.state.monsters[monsterID] = monster
-            self.state.monsters_position[monsterID] = PositionState(position=i, row=Row.FORWARD, dead=False)
+            self.state.monsters_position.append(monsterID)
 
     def _generate_monster_attacks(self):
         # TODO
         state = self.state
+        h = self.zobrist
+        if h is not None:
+            h.value ^= h.attacks(state)
         for monsterID in state.monster_sides:
-            heroID = random.choice(list(state.heroes.keys()))
+            heroID = self.attack_rng.choice(list(state.heroes.keys()))
             state.monster_attacks[monsterID] = [heroID]
+        if h is not None:
+            h.value ^= h.attacks(state)
@@ -0,0 +1,117 @@
+import array
+from typing import Dict, List
+
+import library
+import state
+
+
+# Every value is packed as a signed 16-bit integer:
+#   version, round, phase, is_item_distribution,
+#   heroes_name: count, name...
+#   heroes_position, monsters_position: count, (id, row, dead)...
+#   heroes, monsters: count, (id, name, health, shield, effect...)...
+#     with one value per field in library.EFFECTS, in that order
+#   table_sides, saved_sides, monster_sides: count, (id, side)...
+#   monster_attacks: count, (monster id, targets count, target...)...
+#   heroes_to_select: count, name...
+VERSION = 3
+
+NAMES: List[str] = list(library.OPCODES)
+NAME_INDEX: Dict[str, int] = {name: index for index, name in enumerate(NAMES)}
+
+# Sides never change during play, so restored characters share the templates'
+_HEROES = library.HeroLib.TEMPLATES
+_MONSTERS = library.MonsterLib.TEMPLATES
+
+
+def _with_effects(cs, take):
+    for effect in library.EFFECTS:
+        setattr(cs, effect, take())
+    library.Character.update_disabled(cs)
+    return cs
+
+
+def dump(s: state.SimulatorState) -> bytes:
+    values = [VERSION, s.round, s.phase.value, s.is_item_distribution, len(s.heroes_name)]
+    values.extend(NAME_INDEX[name] for name in s.heroes_name)
+    for positions in (s.heroes_position, s.monsters_position):
+        values.append(len(positions))
+        for characterID, position_state in positions.items():
+            values += (characterID, position_state.row.value, position_state.dead)
+    for characters in (s.heroes, s.monsters):
+        values.append(len(characters))
+        for characterID, cs in characters.items():
+            values += (characterID, NAME_INDEX[cs.name], cs.health, cs.shield)
+            values.extend(getattr(cs, effect) for effect in library.EFFECTS)
+    for sides in (s.table_sides, s.saved_sides, s.monster_sides):
+        values.append(len(sides))
+        for characterID, sideID in sides.items():
+            values += (characterID, sideID)
+    values.append(len(s.monster_attacks))
+    for monsterID, targets in s.monster_attacks.items():
+        values += (monsterID, len(targets))
+        values.extend(targets)
+    values.append(len(s.heroes_to_select))
+    values.extend(NAME_INDEX[name] for name in s.heroes_to_select)
+    return array.array('h', values).tobytes()
+
+
+def load(s: state.SimulatorState, data: bytes):
+    values = array.array('h')
+    values.frombytes(data)
+    take = iter(values).__next__
+    if take() != VERSION:
+        raise ValueError('Unsupported snapshot version')
+
+    s.round = take()
+    s.phase = state.Phase(take())
+    s.is_item_distribution = bool(take())
+    s.heroes_name = [NAMES[take()] for _ in range(take())]
+
+    for field in ('heroes_position', 'monsters_position'):
+        positions = state.Formation()
+        dead = []
+        for _ in range(take()):
+            characterID, row, is_dead = take(), take(), take()
+            positions.append(characterID, state.Row(row))
+            if is_dead:
+                dead.append(characterID)
+        for characterID in dead:
+            positions.mark_dead(characterID)
+        setattr(s, field, positions)
+
+    heroes = {}
+    for _ in range(take()):
+        heroID, name, health, shield = take(), NAMES[take()], take(), take()
+        template = _HEROES[name]
+        heroes[heroID] = _with_effects(state.HeroState(
+            name=name,
+            health=health,
+            level=template.level,
+            role=template.role,
+            shield=shield,
+            sides=template.side_states,
+        ), take)
+    s.heroes = heroes
+
+    monsters = {}
+    for _ in range(take()):
+        monsterID, name, health, shield = take(), NAMES[take()], take(), take()
+        monsters[monsterID] = _with_effects(state.MonsterState(
+            name=name,
+            health=health,
+            shield=shield,
+            sides=_MONSTERS[name].side_states,
+        ), take)
+    s.monsters = monsters
+
+    s.table_sides = {take(): take() for _ in range(take())}
+    s.saved_sides = {take(): take() for _ in range(take())}
+    s.monster_sides = {take(): take() for _ in range(take())}
+    monster_attacks = {}
+    for _ in range(take()):
+        monsterID = take()
+        monster_attacks[monsterID] = [take() for _ in range(take())]
+    s.monster_attacks = monster_attacks
+    s.heroes_to_select = [NAMES[take()] for _ in range(take())]
+    s.dying = []
@@ -1,11 +1,15 @@
 import dataclasses
 import enum
-from typing import Dict, List, OrderedDict
+import types
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, OrderedDict, Tuple
 
+if TYPE_CHECKING:
+    from zobrist import Zobrist
 
-HeroID = str
+
+HeroID = int
 SideID = int
-MonsterID = str
+MonsterID = int
 ItemID = str
 
 
@@ -28,83 +32,156 @@ class HeroRole(enum.Enum):
     GREY = enum.auto()
 
 
-class EffectName(enum.Enum):
-    PETRIFY = enum.auto()
+class SlotAllocator:
+    # Small integer IDs with a free list. IDs are stable inside a battle and
+    # handed out again, lowest first, after reset().
+    def __init__(self):
+        self.size = 0
+        self.free: List[int] = []
 
+    def acquire(self) -> int:
+        if self.free:
+            return self.free.pop()
+        self.size += 1
+        return self.size - 1
 
-@dataclasses.dataclass
-class KeywordState:
-    name: str
+    def release(self, slot: int):
+        self.free.append(slot)
 
+    def reset(self):
+        self.free = list(range(self.size - 1, -1, -1))
 
-@dataclasses.dataclass
-class EffectState:
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class KeywordState:
     name: str
 
 
-@dataclasses.dataclass
-class PetrifyEffectState(EffectState):
-    sides: List[SideID]
+# Shared by every side without keywords
+NO_KEYWORDS: Mapping[str, KeywordState] = types.MappingProxyType({})
 
 
-@dataclasses.dataclass
+# Sides never change during play; one tuple of them is shared by every
+# character of a type, see library.Character.instantiate
+@dataclasses.dataclass(slots=True, frozen=True)
 class SideState:
     id: int
     pip: int
     name: str
-    keywords: Dict[str, KeywordState]
+    keywords: Mapping[str, KeywordState]
 
+    def __post_init__(self):
+        # read-only, like the rest of the side
+        if not isinstance(self.keywords, types.MappingProxyType):
+            object.__setattr__(self, 'keywords', types.MappingProxyType(dict(self.keywords)))
 
-@dataclasses.dataclass
+    def __reduce__(self):
+        # mapping proxies can't be pickled
+        return SideState, (self.id, self.pip, self.name, dict(self.keywords))
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+@dataclasses.dataclass(slots=True)
 class PositionState:
     position: int
     row: Row
     dead: bool
-
-
-@dataclasses.dataclass
+    # nearest alive neighbours, kept up to date by Formation
+    left: Optional[int] = None
+    right: Optional[int] = None
+
+
+class Formation(OrderedDict):
+    # Positions in order plus a doubly linked list of the alive characters,
+    # so the nearest alive neighbour is a single lookup.
+    def append(self, characterID: int, row: Row = Row.FORWARD) -> PositionState:
+        left = None
+        for otherID in reversed(self):
+            if not self[otherID].dead:
+                left = otherID
+                break
+        position_state = PositionState(position=len(self), row=row, dead=False, left=left)
+        if left is not None:
+            self[left].right = characterID
+        self[characterID] = position_state
+        return position_state
+
+    def mark_dead(self, characterID: int):
+        position_state = self[characterID]
+        if position_state.dead:
+            return
+        position_state.dead = True
+        left, right = position_state.left, position_state.right
+        position_state.left = position_state.right = None
+        if left is not None:
+            self[left].right = right
+        if right is not None:
+            self[right].left = left
+
+    def neighbour(self, characterID: int, direction: int) -> Optional[int]:
+        position_state = self[characterID]
+        return position_state.right if direction == 1 else position_state.left
+
+
+@dataclasses.dataclass(slots=True)
 class HeroState:
     name: str
     health: int
     level: int
     role: HeroRole
     shield: int
-    sides: List[SideState]
-    effects: Dict[EffectName, EffectState]
+    sides: Tuple[SideState, ...]
+    # effect bitmasks, see library.Character.can_side_be_used
+    petrified: int = 0
+    disabled: int = 0
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class MonsterState:
     name: str
     health: int
     shield: int
-    sides: List[SideState]
-    effects: Dict[EffectName, EffectState]
+    sides: Tuple[SideState, ...]
+    petrified: int = 0
+    disabled: int = 0
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class SimulatorState:
     round: int = 0
     phase: Phase = Phase.NONE
     is_item_distribution: bool = False
 
     heroes_name: List[str] = dataclasses.field(default_factory=str)
-    heroes_position: OrderedDict[HeroID, PositionState] = dataclasses.field(default_factory=OrderedDict)
+    heroes_position: Formation = dataclasses.field(default_factory=Formation)
     heroes: Dict[HeroID, HeroState] = dataclasses.field(default_factory=dict)
     monsters: Dict[MonsterID, MonsterState] = dataclasses.field(default_factory=dict)
-    monsters_position: OrderedDict[HeroID, PositionState] = dataclasses.field(default_factory=OrderedDict)
+    monsters_position: Formation = dataclasses.field(default_factory=Formation)
     # items: List[Item]
 
     table_sides: Dict[HeroID, SideID] = dataclasses.field(default_factory=dict)
     saved_sides: Dict[HeroID, SideID] = dataclasses.field(default_factory=dict)
     monster_sides: Dict[MonsterID, SideID] = dataclasses.field(default_factory=dict)
     monster_attacks: Dict[MonsterID, List[HeroID]] = dataclasses.field(default_factory=dict)
+    # characters whose health crossed zero and still have to be removed
+    dying: List[HeroID | MonsterID] = dataclasses.field(default_factory=list)
+    # undo records of the action being applied, see simulator.UndoLog
+    journal: Optional[list] = dataclasses.field(default=None, compare=False, repr=False)
+    # running hash kept up to date by the simulator, see zobrist.Zobrist
+    zobrist: Optional['Zobrist'] = dataclasses.field(default=None, compare=False, repr=False)
 
     heroes_to_select: List[str] = dataclasses.field(default_factory=list)
     items_to_select: List[ItemID] = dataclasses.field(default_factory=list)
 
-    def serialize(self):
-        pass
+    # Packed binary snapshots, see snapshot.py. Bytes are hashable and cheap
+    # to send to other processes.
+    def serialize(self) -> bytes:
+        import snapshot
+        return snapshot.dump(self)
 
-    def deserialize(self):
-        pass
+    def deserialize(self, data: bytes) -> 'SimulatorState':
+        import snapshot
+        snapshot.load(self, data)
+        return self
@@ -0,0 +1,17 @@
+import math
+
+from batch import BatchSimulator
+from runner import run
+from sequential import z_score
+
+GAMES = 4000
+RUNS = 1000
+
+
+def test_win_rate_matches_simulator():
+    # Different dice, the same policy: the two win rates agree within a
+    # 99.9% interval of their difference
+    batch = BatchSimulator(GAMES, seed=1).run().success / GAMES
+    simulator = run(RUNS, workers=1, seed=1).win_rate
+    stderr = math.sqrt(batch * (1 - batch) / GAMES + simulator * (1 - simulator) / RUNS)
+    assert abs(batch - simulator) <= z_score(0.999) * stderr
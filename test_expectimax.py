@@ -0,0 +1,77 @@
+import math
+
+import pytest
+
+from expectimax import Expectimax
+from simulator import Action, ActionBattleApplySide, ActionBattleEndTurn, ActionBattleSaveSide, Simulator
+
+# Stone shield sides: every die is a sword or nothing, and with 1 health
+# each hero dies to the first hit, so a battle ends within a few turns and
+# the engine's value is exact
+SHIELDS = {'fighter': 0b001100, 'defender': 0b000111}
+TRIALS = 3000
+
+
+def _position(names, monster, monster_health) -> Simulator:
+    simulator = Simulator(seed=0)
+    simulator.set_up({'seed': 0})
+    s = simulator.state
+    heroIDs = list(s.heroes)
+    for heroID, name in zip(heroIDs, names):
+        hero = simulator.heroesLib.getByName(name).instantiate()
+        hero.health = 1
+        hero.petrified = hero.disabled = SHIELDS[name]
+        s.heroes[heroID] = hero
+    for heroID in heroIDs[len(names):]:
+        s.heroes[heroID].health = 0
+        Action.check_and_remove_target(s, heroID)
+    monsterIDs = list(s.monsters)
+    s.monsters[monsterIDs[0]] = simulator.monstersLib.getByName(monster).instantiate()
+    s.monsters[monsterIDs[0]].health = monster_health
+    for monsterID in monsterIDs[1:]:
+        s.monsters[monsterID].health = 0
+        Action.check_and_remove_target(s, monsterID)
+    s.monster_attacks = {monsterIDs[0]: [heroIDs[0]]}
+    simulator.apply_actions([ActionBattleSaveSide(list(s.heroes))])
+    return simulator
+
+
+def _play(simulator: Simulator, engine: Expectimax, data: bytes, seed: int):
+    # The rest of the battle with the engine's targets and the simulator's dice
+    s = simulator.state
+    s.deserialize(data)
+    simulator.rng.seed(seed)
+    while True:
+        actions = [ActionBattleApplySide(*step) for step in engine.plan(s)] + [ActionBattleEndTurn()]
+        for action in actions:
+            simulator.apply_actions([action])
+            if not s.monsters or not s.heroes:
+                return not s.monsters, set(s.heroes)
+        simulator.apply_actions([ActionBattleSaveSide(list(s.heroes))])
+
+
+@pytest.mark.parametrize('names, monster, monster_health', [
+    (['fighter', 'defender', 'fighter'], 'wolf', 7),
+    (['defender', 'fighter', 'fighter'], 'rat', 5),
+])
+def test_exact_values_match_monte_carlo(names, monster, monster_health):
+    simulator = _position(names, monster, monster_health)
+    engine = Expectimax(horizon=2)
+    evaluation = engine.evaluate(simulator.state)
+    assert evaluation.exact
+
+    data = simulator.state.serialize()
+    wins = 0
+    survived = dict.fromkeys(evaluation.survival, 0)
+    for seed in range(TRIALS):
+        won, alive = _play(simulator, engine, data, seed)
+        wins += won
+        for heroID in alive:
+            survived[heroID] += 1
+
+    def close(probability, count):
+        return abs(count / TRIALS - probability) <= 4 * math.sqrt(probability * (1 - probability) / TRIALS) + 1e-9
+
+    assert close(evaluation.score, wins)
+    for heroID, probability in evaluation.survival.items():
+        assert close(probability, survived[heroID])
@@ -0,0 +1,89 @@
+import collections
+import itertools
+import math
+import random
+
+import pytest
+
+import library
+
+SAMPLES = 40000
+
+
+def _alias_distribution(pool: library.HeroPool):
+    # the exact probability of each hero under the alias tables
+    count = len(pool.heroes)
+    distribution = [p / count for p in pool.probability]
+    for index, alias in enumerate(pool.alias):
+        distribution[alias] += (1 - pool.probability[index]) / count
+    return distribution
+
+
+@pytest.mark.parametrize('weights', [
+    [1.0, 2.0, 3.0, 4.0],
+    [0.1, 10.0, 0.1],
+    [5.0, 1.0, 1.0, 1.0],
+])
+def test_hero_pool_alias_frequencies(weights):
+    heroes = list(library.HeroLib.TEMPLATES.values())[:len(weights)]
+    pool = library.HeroPool(heroes, weights)
+    total = sum(weights)
+    expected = [weight / total for weight in weights]
+    assert _alias_distribution(pool) == pytest.approx(expected, abs=1e-12)
+
+    rng = random.Random(0)
+    counts = collections.Counter(pool.sample(rng).name for _ in range(SAMPLES))
+    for hero, p in zip(heroes, expected):
+        assert abs(counts[hero.name] / SAMPLES - p) <= 4 * math.sqrt(p * (1 - p) / SAMPLES)
+
+
+def test_hero_pool_uniform():
+    heroes = list(library.HeroLib.TEMPLATES.values())[:3]
+    assert library.HeroPool(heroes, [2.0, 2.0, 2.0]).probability is None
+    rng = random.Random(0)
+    counts = collections.Counter(library.HeroPool(heroes).sample(rng).name for _ in range(SAMPLES))
+    assert set(counts) == {hero.name for hero in heroes}
+
+
+def _brute_survival(names, health, shield):
+    # every roll of every monster, hit in order with Character.takeDamage
+    opcodes = [library.OPCODES[name] for name in names]
+    survived = 0
+    for roll in itertools.product(*opcodes):
+        hero = library.HeroLib.TEMPLATES['fighter'].instantiate()
+        hero.health, hero.shield = health, shield
+        for kind, pip, _ in roll:
+            if kind == library.OP_SWORD:
+                library.Character.takeDamage(hero, pip)
+        survived += hero.health > 0
+    return survived / 6 ** len(names)
+
+
+def test_survival_matches_enumeration():
+    monsters = list(library.MonsterLib.ALL_MONSTERS)
+    for count in range(1, library.MonsterLib.MAX_ATTACKERS + 1):
+        for names in itertools.product(monsters, repeat=count):
+            for health in range(0, 9):
+                for shield in range(0, 7):
+                    assert library.MonsterLib.survival(names, health, shield) == pytest.approx(
+                        _brute_survival(names, health, shield), abs=1e-12,
+                    ), (names, health, shield)
+
+
+def test_survival_random_targets_matches_enumeration():
+    # each monster picks one of the heroes uniformly
+    names = tuple(library.MonsterLib.ALL_MONSTERS)[:3]
+    for heroes_count in (1, 2, 3):
+        for health, shield in ((1, 0), (3, 1), (5, 2)):
+            expected = 0.0
+            for targets in itertools.product(range(heroes_count), repeat=len(names)):
+                attackers = tuple(name for name, target in zip(names, targets) if target == 0)
+                expected += _brute_survival(attackers, health, shield) / heroes_count ** len(names)
+            assert library.MonsterLib.survival_random_targets(names, health, shield, heroes_count) == pytest.approx(expected)
+
+
+def test_expected_damage():
+    for name, opcodes in library.OPCODES.items():
+        if name in library.MonsterLib.ALL_MONSTERS:
+            expected = sum(pip for kind, pip, _ in opcodes if kind == library.OP_SWORD) / len(opcodes)
+            assert library.MonsterLib.expected_damage((name,)) == pytest.approx(expected)
@@ -0,0 +1,39 @@
+import random
+import statistics
+
+import pytest
+
+from pipeline import Welford
+
+
+def _welford(values) -> Welford:
+    w = Welford()
+    for x in values:
+        w.add(x)
+    return w
+
+
+@pytest.mark.parametrize('cuts', [[], [0], [1], [500], [3, 3, 700], [10, 200, 999]])
+def test_merge_matches_single_pass(cuts):
+    rng = random.Random(0)
+    values = [rng.gauss(12, 5) for _ in range(1000)]
+    bounds = [0] + cuts + [len(values)]
+    merged = Welford()
+    for start, stop in zip(bounds, bounds[1:]):
+        merged.merge(_welford(values[start:stop]))
+
+    single = _welford(values)
+    assert merged.count == single.count == len(values)
+    assert merged.mean == pytest.approx(single.mean, rel=1e-12)
+    assert merged.variance == pytest.approx(single.variance, rel=1e-9)
+    assert merged.mean == pytest.approx(statistics.fmean(values), rel=1e-12)
+    assert merged.variance == pytest.approx(statistics.variance(values), rel=1e-9)
+
+
+def test_merge_empty():
+    w = _welford([1.0, 2.0, 4.0])
+    w.merge(Welford())
+    assert (w.count, w.mean) == (3, pytest.approx(7 / 3))
+    empty = Welford()
+    empty.merge(w)
+    assert (empty.count, empty.mean, empty.m2) == (w.count, w.mean, w.m2)
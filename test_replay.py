@@ -0,0 +1,71 @@
+import pytest
+
+from bot import Bot
+from replay import Replay, Replayer, decode, encode, read_replays, record_campaigns, write_replays
+from simulator import Simulator
+
+CAMPAIGNS = 5
+
+
+def _observed(replayer: Replayer):
+    simulator = replayer.simulator
+    return (
+        simulator.state.serialize(),
+        [rng.getstate() for rng in replayer.rngs],
+        list(simulator.last_fight_monsters),
+    )
+
+
+@pytest.fixture(scope='module')
+def replays():
+    return list(record_campaigns(CAMPAIGNS, seed=3))
+
+
+def test_decode_encode_round_trip(replays):
+    for replay in replays:
+        out = bytearray()
+        for batch in decode(replay.actions):
+            encode(batch, out)
+        assert bytes(out) == replay.actions
+
+
+def test_file_round_trip(replays, tmp_path):
+    path = str(tmp_path / 'replays.bin')
+    assert write_replays(path, replays) == CAMPAIGNS
+    assert list(read_replays(path)) == replays
+    assert list(read_replays(path, count=2)) == replays[:2]
+    data = b''.join(replay.to_bytes() for replay in replays)
+    assert Replay.from_bytes(data)[0] == replays[0]
+
+
+@pytest.mark.parametrize('streams', [False, True])
+def test_replay_matches_the_recorded_campaign(streams):
+    replay = next(record_campaigns(1, seed=3, bot_factory=lambda: Bot(streams=streams)))
+    bot = Bot(streams=streams)
+    round, _ = bot.run({**replay.settings, 'seed': replay.seed})
+    simulator = Replayer(replay).run()
+    assert simulator.state.round == round
+    assert simulator.state.serialize() == bot.simulator.state.serialize()
+
+
+@pytest.mark.parametrize('checkpoint_every', [0, 1, 5])
+def test_seek_matches_linear_replay(replays, checkpoint_every):
+    for replay in replays:
+        # the state at the start of every round, played straight through
+        linear = Replayer(replay, checkpoint_every=0)
+        expected = {}
+        while True:
+            expected.setdefault(linear.round, _observed(linear))
+            if linear.done:
+                break
+            linear.step()
+        last = linear.round
+
+        seeking = Replayer(replay, checkpoint_every=checkpoint_every)
+        for round in sorted(expected, reverse=True) + sorted(expected):
+            seeking.seek(round)
+            assert seeking.round == round
+            assert _observed(seeking) == expected[round]
+        # past the end of a lost campaign, seek stops at the end
+        seeking.seek(last + 1)
+        assert seeking.done and seeking.round == last
@@ -0,0 +1,28 @@
+import functools
+
+import pytest
+
+from bot import Bot
+from runner import factory_key, run
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_workers_play_the_same_campaigns(workers):
+    serial = run(60, workers=1, seed=7)
+    parallel = run(60, workers=workers, seed=7)
+    assert parallel.runs == serial.runs == 60
+    assert parallel.wins == serial.wins
+    assert parallel.rounds == serial.rounds
+    assert parallel.loss_monsters == serial.loss_monsters
+
+
+def test_short_run_reports_no_speedup():
+    # too short to leave the pool anything after calibration
+    stats = run(2, workers=2, seed=7)
+    assert stats.runs == 2
+    assert stats.speedup is None and 'n/a' in stats.summary()
+
+
+def test_factory_key_is_stable():
+    assert factory_key(functools.partial(Bot, shield_rule='lowest')) == factory_key(functools.partial(Bot, shield_rule='lowest'))
+    assert factory_key(functools.partial(Bot, shield_rule='lowest')) != factory_key(Bot)
@@ -0,0 +1,60 @@
+import pytest
+
+from pipeline import CampaignRecord
+from sequential import SPRT, estimate, wilson
+
+
+@pytest.mark.parametrize('wins, runs, low, high', [
+    # textbook 95% Wilson intervals
+    (0, 10, 0.0, 0.2775),
+    (5, 10, 0.2366, 0.7634),
+    (10, 10, 0.7225, 1.0),
+    (81, 263, 0.2553, 0.3662),
+])
+def test_wilson(wins, runs, low, high):
+    interval = wilson(wins, runs)
+    assert interval == pytest.approx((low, high), abs=1e-4)
+
+
+def test_wilson_without_runs():
+    assert wilson(0, 0) == (0.0, 1.0)
+
+
+def test_sprt_decisions():
+    sprt = SPRT(0.5, delta=0.1)
+    # every win adds log(0.6 / 0.4), the bound is log(0.95 / 0.05)
+    assert sprt.decide(7, 7) is None
+    assert sprt.decide(8, 8) is True
+    assert sprt.decide(0, 7) is None
+    assert sprt.decide(0, 8) is False
+    # wins and losses cancel out
+    assert sprt.decide(500, 1000) is None
+
+
+def _records(pattern, count):
+    return (CampaignRecord(index, 20 if pattern(index) else 5, (), ()) for index in range(count))
+
+
+@pytest.mark.parametrize('pattern, above', [
+    (lambda index: index % 10 != 0, True),
+    (lambda index: index % 10 == 0, False),
+])
+def test_estimate_stops_on_sprt(pattern, above):
+    result = estimate(_records(pattern, 10000), budget=10000, batch=10, sprt=SPRT(0.5))
+    assert result.stopped_by == 'sprt'
+    assert result.above is above
+    assert result.runs < 10000 and result.runs % 10 == 0
+
+
+def test_estimate_stops_on_precision():
+    result = estimate(_records(lambda index: index % 2 == 0, 10000), budget=10000, batch=100, precision=0.05)
+    assert result.stopped_by == 'precision'
+    low, high = result.interval
+    assert (high - low) / 2 <= 0.05
+    assert result.runs == 400
+
+
+def test_estimate_runs_out_of_budget():
+    result = estimate(_records(lambda index: index % 2 == 0, 10000), budget=250, batch=100, sprt=SPRT(0.5))
+    assert result.stopped_by == 'budget'
+    assert result.above is None and result.runs == 250
@@ -0,0 +1,90 @@
+import pytest
+
+from bot import Bot
+from simulator import ActionBattleUndo, Simulator
+from state import Phase, SimulatorState
+
+
+def _observed(simulator: Simulator):
+    # everything an undo has to give back
+    return (
+        simulator.state.serialize(),
+        [rng.getstate() for rng in simulator.undo_log.rngs],
+        list(simulator.last_fight_monsters),
+    )
+
+
+class Checked:
+    # Simulator.apply_actions that undoes every call and applies it again,
+    # checking the state, the dice and the hash along the way
+    def __init__(self, simulator: Simulator):
+        self.simulator = simulator
+        self.apply_actions = simulator.apply_actions
+        self.calls = 0
+        simulator.apply_actions = self
+
+    def __call__(self, actions):
+        simulator = self.simulator
+        entries = simulator.undo_log.entries
+        before = _observed(simulator)
+        count = len(entries)
+        self.apply_actions(actions)
+        after = _observed(simulator)
+        assert simulator.zobrist.value == simulator.zobrist.full(simulator.state)
+
+        assert self.apply_actions([ActionBattleUndo(len(entries) - count)])[0].success
+        assert _observed(simulator) == before
+        assert simulator.zobrist.value == simulator.zobrist.full(simulator.state)
+
+        # the restored dice replay the same outcome
+        results = self.apply_actions(actions)
+        assert _observed(simulator) == after
+        self.calls += 1
+        return results
+
+
+@pytest.mark.parametrize('streams', [False, True])
+def test_undo_round_trip(streams):
+    bot = Bot(streams=streams)
+    bot.simulator = Simulator(undo=True, zobrist_seed=1, streams=streams)
+    checked = Checked(bot.simulator)
+    for seed in range(5):
+        bot.run({'seed': seed})
+    assert checked.calls > 0
+
+
+def test_zobrist_matches_full():
+    bot = Bot()
+    bot.simulator = simulator = Simulator(zobrist_seed=1)
+    apply_actions = simulator.apply_actions
+
+    def checked(actions):
+        results = apply_actions(actions)
+        assert simulator.zobrist.value == simulator.zobrist.full(simulator.state)
+        return results
+
+    simulator.apply_actions = checked
+    for seed in range(20):
+        bot.run({'seed': seed})
+        assert simulator.zobrist.value == simulator.zobrist.full(simulator.state)
+
+
+def test_snapshot_round_trip():
+    bot = Bot()
+    simulator = bot.simulator
+    apply_actions = simulator.apply_actions
+    checked = []
+
+    def round_trip(actions):
+        results = apply_actions(actions)
+        data = simulator.state.serialize()
+        restored = SimulatorState().deserialize(data)
+        assert restored == simulator.state
+        assert restored.serialize() == data
+        checked.append(restored.phase)
+        return results
+
+    simulator.apply_actions = round_trip
+    for seed in range(20):
+        bot.run({'seed': seed})
+    assert Phase.LEVEL_UP in checked and Phase.FINISHED in checked
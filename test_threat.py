@@ -0,0 +1,77 @@
+import pytest
+
+import bot
+import library
+from threat import ThreatModel
+
+
+def _pips(s):
+    return {
+        monsterID: library.OPCODES[s.monsters[monsterID].name][sideID][1]
+        for monsterID, sideID in s.monster_sides.items()
+    }
+
+
+def _left(s, pips):
+    # the old linear scans: health + shield - incoming for attacked heroes,
+    # in the order of their first attacker
+    left = {}
+    for monsterID, pip in pips.items():
+        heroID = s.monster_attacks[monsterID][0]
+        if heroID in s.heroes:
+            hero = s.heroes[heroID]
+            left.setdefault(heroID, hero.health + hero.shield)
+            left[heroID] -= pip
+    return left
+
+
+class Checked(ThreatModel):
+    # Every answer checked against a scan of the whole state
+    calls = 0
+
+    def __init__(self, s):
+        super().__init__(s)
+        self.s = s
+
+    def weakest_monster(self):
+        answer = super().weakest_monster()
+        pips = _pips(self.s)
+        best = min(pips, key=lambda monsterID: (self.s.monsters[monsterID].health, -pips[monsterID]))
+        assert answer == (best if pips[best] else None)
+        Checked.calls += 1
+        return answer
+
+    def most_endangered(self):
+        answer = super().most_endangered()
+        left = _left(self.s, _pips(self.s))
+        assert answer == (min(left, key=left.get) if left else None)
+        Checked.calls += 1
+        return answer
+
+    def weakest_killer(self, strongest=True):
+        answer = super().weakest_killer(strongest)
+        s = self.s
+        pips = _pips(s)
+        left = _left(s, pips)
+        assert self.dying() == sorted((heroID for heroID in left if left[heroID] <= 0), key=left.get)
+        killers = [
+            (s.monsters[monsterID].health, -pip if strongest else pip)
+            for monsterID, pip in pips.items() if s.monster_attacks[monsterID][0] in self.dying()
+        ]
+        if not killers:
+            assert answer is None
+        else:
+            # ties between equal monsters may go either way
+            assert (s.monsters[answer].health, -pips[answer] if strongest else pips[answer]) == min(killers)
+        Checked.calls += 1
+        return answer
+
+
+@pytest.mark.parametrize('killers_first, strongest_killer', [(False, True), (True, True), (True, False)])
+def test_matches_linear_scans(monkeypatch, killers_first, strongest_killer):
+    monkeypatch.setattr(bot, 'ThreatModel', Checked)
+    Checked.calls = 0
+    player = bot.Bot(killers_first=killers_first, strongest_killer=strongest_killer)
+    for seed in range(20):
+        player.run({'seed': seed})
+    assert Checked.calls > 1000
@@ -0,0 +1,108 @@
+import bisect
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import library
+import state
+
+
+class ThreatModel:
+    # This turn's monster attacks, built once from monster_sides and
+    # monster_attacks and updated in place as sides are applied. Both lists
+    # stay sorted, so the answers are at the front:
+    #   monsters: (health, -pip, order, monsterID)
+    #   heroes:   (health + shield - incoming damage, first attack order, heroID)
+    #             for heroes an alive monster attacks
+    def __init__(self, s: state.SimulatorState):
+        self.pip: Dict[state.MonsterID, int] = {}
+        self.order: Dict[state.MonsterID, int] = {}
+        self.target: Dict[state.MonsterID, state.HeroID] = {}
+        self.incoming: Dict[state.HeroID, int] = {}
+        self.attackers: Dict[state.HeroID, List[int]] = {}
+        self.monster_keys: Dict[state.MonsterID, tuple] = {}
+        self.hero_keys: Dict[state.HeroID, tuple] = {}
+
+        for order, (monsterID, sideID) in enumerate(s.monster_sides.items()):
+            monster_state = s.monsters[monsterID]
+            pip = library.OPCODES[monster_state.name][sideID][1]
+            heroID = s.monster_attacks[monsterID][0]
+            self.pip[monsterID] = pip
+            self.order[monsterID] = order
+            self.target[monsterID] = heroID
+            self.incoming[heroID] = self.incoming.get(heroID, 0) + pip
+            self.attackers.setdefault(heroID, []).append(order)
+            self.monster_keys[monsterID] = self._monster_key(monster_state, monsterID)
+        for heroID in self.attackers:
+            self.hero_keys[heroID] = self._hero_key(s, heroID)
+        self.monsters: List[tuple] = sorted(self.monster_keys.values())
+        self.heroes: List[tuple] = sorted(self.hero_keys.values())
+
+    def _monster_key(self, monster_state: state.MonsterState, monsterID: state.MonsterID) -> tuple:
+        return monster_state.health, -self.pip[monsterID], self.order[monsterID], monsterID
+
+    def _hero_key(self, s: state.SimulatorState, heroID: state.HeroID) -> Tuple[int, int, int]:
+        hero_state = s.heroes[heroID]
+        return (
+            hero_state.health + hero_state.shield - self.incoming[heroID],
+            self.attackers[heroID][0],
+            heroID,
+        )
+
+    def weakest_monster(self) -> Optional[state.MonsterID]:
+        # Lowest-HP monster with the highest attack, None if that attack is 0
+        if not self.monsters or self.monsters[0][1] == 0:
+            return None
+        return self.monsters[0][3]
+
+    def weakest_killer(self, strongest: bool = True) -> Optional[state.MonsterID]:
+        # Lowest-HP monster attacking a dying hero, the hardest hitting one
+        # first unless strongest is False
+        dying = set(self.dying())
+        keys = [
+            self.monster_keys[monsterID] for monsterID, heroID in self.target.items()
+            if heroID in dying and monsterID in self.monster_keys
+        ]
+        if not keys:
+            return None
+        if strongest:
+            return min(keys)[3]
+        return min(keys, key=lambda key: (key[0], -key[1], key[2]))[3]
+
+    def most_endangered(self) -> Optional[state.HeroID]:
+        # Attacked hero left with the least health and shield
+        return self.heroes[0][2] if self.heroes else None
+
+    def dying(self) -> List[state.HeroID]:
+        # Heroes this turn's attacks would kill, most endangered first
+        end = bisect.bisect_left(self.heroes, (1,))
+        return [key[2] for key in self.heroes[:end]]
+
+    def update(self, s: state.SimulatorState, characterIDs: Iterable[int]):
+        # Re-key the characters a side was just applied to
+        for characterID in characterIDs:
+            if characterID in self.monster_keys:
+                self._remove(self.monsters, self.monster_keys.pop(characterID))
+                monster_state = s.monsters.get(characterID)
+                if monster_state is not None:
+                    key = self.monster_keys[characterID] = self._monster_key(monster_state, characterID)
+                    bisect.insort(self.monsters, key)
+                    continue
+                # dead monsters don't attack
+                heroID = self.target.pop(characterID)
+                self.incoming[heroID] -= self.pip[characterID]
+                self.attackers[heroID].remove(self.order[characterID])
+                if not self.attackers[heroID]:
+                    del self.attackers[heroID]
+                self._rekey_hero(s, heroID)
+            elif characterID in self.hero_keys:
+                self._rekey_hero(s, characterID)
+
+    def _rekey_hero(self, s: state.SimulatorState, heroID: state.HeroID):
+        if heroID in self.hero_keys:
+            self._remove(self.heroes, self.hero_keys.pop(heroID))
+        if heroID in s.heroes and heroID in self.attackers:
+            key = self.hero_keys[heroID] = self._hero_key(s, heroID)
+            bisect.insort(self.heroes, key)
+
+    @staticmethod
+    def _remove(keys: List[tuple], key: tuple):
+        del keys[bisect.bisect_left(keys, key)]
@@ -0,0 +1,175 @@
+import argparse
+import dataclasses
+import itertools
+import multiprocessing
+import os
+import random
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import bot
+from runner import LAST_ROUND, campaign_seed
+from sequential import wilson
+
+
+# Bot keyword arguments to search, see Bot
+SPACE: Dict[str, list] = {
+    'killers_first': [False, True],
+    'strongest_killer': [True, False],
+    'shield_rule': list(bot.SHIELD_RULES),
+}
+
+# parameter -> (parameter, value) under which Bot ignores it
+IGNORED_WHEN = {
+    'strongest_killer': ('killers_first', False),
+}
+
+Config = Tuple[Tuple[str, object], ...]
+
+
+def canonical(config: Config) -> Config:
+    # Drops the parameters Bot would ignore, so configs playing the same
+    # policy compare equal
+    values = dict(config)
+    return tuple(
+        (name, value) for name, value in config
+        if name not in IGNORED_WHEN or values.get(IGNORED_WHEN[name][0]) != IGNORED_WHEN[name][1]
+    )
+
+
+def grid(space: Dict[str, list]) -> List[Config]:
+    # one config per distinct policy
+    names = sorted(space)
+    configs = (tuple(zip(names, values)) for values in itertools.product(*(space[name] for name in names)))
+    return list(dict.fromkeys(canonical(config) for config in configs))
+
+
+def sample(space: Dict[str, list], count: int, rng: random.Random) -> List[Config]:
+    configs = grid(space)
+    return rng.sample(configs, min(count, len(configs)))
+
+
+def describe(config: Config) -> str:
+    return ' '.join(f'{name}={value}' for name, value in config)
+
+
+_bots: Dict[Config, bot.Bot] = {}
+
+
+def _play(args) -> Tuple[Config, int, int]:
+    # (config, wins, runs) over campaigns [start, stop)
+    config, seed, start, stop = args
+    player = _bots.get(config)
+    if player is None:
+        player = _bots[config] = bot.Bot(streams=True, **dict(config))
+    wins = sum(
+        player.run({'seed': campaign_seed(seed, index)})[0] == LAST_ROUND
+        for index in range(start, stop)
+    )
+    return config, wins, stop - start
+
+
+@dataclasses.dataclass
+class Entry:
+    config: Config
+    wins: int = 0
+    runs: int = 0
+    # last rung the config was played in
+    rung: int = 0
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.runs if self.runs else 0.0
+
+
+class Tournament:
+    # Successive halving: every live config plays the same next block of
+    # campaigns (same seeds and streams, so the comparison is paired), then
+    # the best 1/eta survive and the block grows eta times, until one config
+    # is left or the budget is spent. Blocks are split across the pool.
+    def __init__(
+        self,
+        configs: Sequence[Config],
+        seed: int,
+        min_runs: int = 100,
+        eta: int = 2,
+        budget: Optional[int] = None,
+        workers: int = 1,
+        chunk: int = 50,
+    ):
+        self.entries = {config: Entry(config) for config in configs}
+        self.seed = seed
+        self.min_runs = min_runs
+        self.eta = eta
+        self.budget = budget
+        self.workers = workers
+        self.chunk = chunk
+        self.spent = 0
+
+    def run(self) -> List[Entry]:
+        live = list(self.entries.values())
+        played = 0
+        block = self.min_runs
+        rung = 0
+        pool = multiprocessing.Pool(self.workers) if self.workers > 1 else None
+        try:
+            while live:
+                if self.budget is not None:
+                    block = min(block, (self.budget - self.spent) // len(live))
+                    if block <= 0:
+                        break
+                jobs = [
+                    (entry.config, self.seed, start, min(start + self.chunk, played + block))
+                    for entry in live
+                    for start in range(played, played + block, self.chunk)
+                ]
+                for config, wins, runs in (pool.imap_unordered if pool else map)(_play, jobs):
+                    entry = self.entries[config]
+                    entry.wins += wins
+                    entry.runs += runs
+                    entry.rung = rung
+                self.spent += block * len(live)
+                played += block
+                if len(live) == 1:
+                    break
+                live.sort(key=lambda entry: entry.win_rate, reverse=True)
+                live = live[:max(1, len(live) // self.eta)]
+                block *= self.eta
+                rung += 1
+        finally:
+            if pool is not None:
+                pool.terminate()
+        return self.ranking()
+
+    def ranking(self) -> List[Entry]:
+        # survivors of later rungs first, then by win rate
+        return sorted(self.entries.values(), key=lambda entry: (entry.rung, entry.win_rate), reverse=True)
+
+    def table(self, confidence: float = 0.95) -> str:
+        lines = [f'{"#":>3} {"rung":>4} {"runs":>7} {"win rate":>8} {"interval":>17}  config']
+        for rank, entry in enumerate(self.ranking(), 1):
+            low, high = wilson(entry.wins, entry.runs, confidence)
+            lines.append(
+                f'{rank:3} {entry.rung:4} {entry.runs:7} {entry.win_rate:8.4f} '
+                f'[{low:.4f}, {high:.4f}]  {describe(entry.config)}'
+            )
+        lines.append(f'campaigns: {self.spent}')
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sample', type=int, default=None, help='random configs instead of the full grid')
+    parser.add_argument('--min-runs', type=int, default=100)
+    parser.add_argument('--eta', type=int, default=2)
+    parser.add_argument('--budget', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.SystemRandom().getrandbits(32)
+    configs = grid(SPACE) if args.sample is None else sample(SPACE, args.sample, random.Random(seed))
+    tournament = Tournament(
+        configs, seed, min_runs=args.min_runs, eta=args.eta, budget=args.budget, workers=args.workers,
+    )
+    tournament.run()
+    print(tournament.table())
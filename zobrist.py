@@ -0,0 +1,184 @@
+import abc
+import collections
+from typing import Any, Dict, Hashable, Optional
+
+import library
+from state import SimulatorState
+
+
+MASK64 = (1 << 64) - 1
+
+# Feature kinds, mixed into the key code
+NAME = 0
+HEALTH = 1
+SHIELD = 2
+TABLE_SIDE = 3
+SAVED_SIDE = 4
+MONSTER_SIDE = 5
+MONSTER_ATTACK = 6
+ROUND = 7
+PHASE = 8
+# one kind per field in library.EFFECTS, from here on. disabled is derived
+# from them, so it isn't hashed.
+EFFECT = 9
+EFFECT_KINDS = tuple((EFFECT + index, effect) for index, effect in enumerate(library.EFFECTS))
+
+NAMES = {name: index for index, name in enumerate(library.OPCODES)}
+
+
+def _splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+class Zobrist:
+    # Running 64-bit hash of a battle: every feature (character slot and name,
+    # health, shield, effect masks, rolled and saved sides, monster targets,
+    # round and phase) has its own key and the hash is their XOR, so a change
+    # is two XORs. Keys are derived from the seed, the same in every process.
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self.keys: Dict[int, int] = {}
+        self.value = 0
+
+    def key(self, kind: int, slot: int, value: int) -> int:
+        code = (kind << 48) | ((slot & 0xffff) << 32) | (value & 0xffffffff)
+        key = self.keys.get(code)
+        if key is None:
+            key = self.keys[code] = _splitmix64(_splitmix64(self.seed) ^ code)
+        return key
+
+    def character(self, characterID: int, character_state) -> int:
+        h = (
+            self.key(NAME, characterID, NAMES[character_state.name])
+            ^ self.key(HEALTH, characterID, character_state.health)
+            ^ self.key(SHIELD, characterID, character_state.shield)
+        )
+        for kind, effect in EFFECT_KINDS:
+            h ^= self.key(kind, characterID, getattr(character_state, effect))
+        return h
+
+    def sides(self, state: SimulatorState) -> int:
+        h = 0
+        for heroID, sideID in state.table_sides.items():
+            h ^= self.key(TABLE_SIDE, heroID, sideID)
+        for heroID, sideID in state.saved_sides.items():
+            h ^= self.key(SAVED_SIDE, heroID, sideID)
+        for monsterID, sideID in state.monster_sides.items():
+            h ^= self.key(MONSTER_SIDE, monsterID, sideID)
+        return h
+
+    def attacks(self, state: SimulatorState) -> int:
+        h = 0
+        for monsterID, heroIDs in state.monster_attacks.items():
+            for heroID in heroIDs:
+                h ^= self.key(MONSTER_ATTACK, monsterID, heroID)
+        return h
+
+    def full(self, state: SimulatorState) -> int:
+        h = self.key(ROUND, 0, state.round) ^ self.key(PHASE, 0, state.phase.value)
+        for characters in (state.heroes, state.monsters):
+            for characterID, character_state in characters.items():
+                h ^= self.character(characterID, character_state)
+        return h ^ self.sides(state) ^ self.attacks(state)
+
+    def reset(self, state: SimulatorState) -> int:
+        self.value = self.full(state)
+        return self.value
+
+
+class TranspositionTable(abc.ABC):
+    # Bounded cache of evaluated values keyed by any hashable (usually a
+    # Zobrist value). An entry answers a lookup only if it was searched at
+    # least as deep as asked. Counters are for sizing the table.
+    def __init__(self, capacity: int = 1 << 16):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abc.abstractmethod
+    def get(self, key: Hashable, depth: int = 0) -> Optional[Any]:
+        pass
+
+    @abc.abstractmethod
+    def store(self, key: Hashable, value: Any, depth: int = 0):
+        pass
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'capacity': self.capacity,
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+        }
+
+
+class LRUTable(TranspositionTable):
+    def __init__(self, capacity: int = 1 << 16):
+        super().__init__(capacity)
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+
+    def get(self, key, depth=0):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < depth:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def store(self, key, value, depth=0):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        elif len(self.entries) >= self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = (depth, value)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DepthPreferredTable(TranspositionTable):
+    # One entry per bucket; a colliding store only replaces an entry searched
+    # no deeper than itself
+    def __init__(self, capacity: int = 1 << 16):
+        super().__init__(capacity)
+        self.buckets: list = [None] * capacity
+        self.size = 0
+
+    def get(self, key, depth=0):
+        entry = self.buckets[hash(key) % self.capacity]
+        if entry is None or entry[0] != key or entry[1] < depth:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[2]
+
+    def store(self, key, value, depth=0):
+        index = hash(key) % self.capacity
+        entry = self.buckets[index]
+        if entry is None:
+            self.size += 1
+        elif entry[0] != key:
+            if entry[1] > depth:
+                return
+            self.evictions += 1
+        self.buckets[index] = (key, depth, value)
+
+    def __len__(self):
+        return self.size